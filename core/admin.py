@@ -1,8 +1,11 @@
 from django.contrib import admin
-from .models import Course, Lecture, Question, Student, Submission, Profile
+from .models import Course, Lecture, LectureJob, PipelineRun, PipelineStage, Question, Student, Submission, Profile
 
 admin.site.register(Course)
 admin.site.register(Lecture)
+admin.site.register(LectureJob)
+admin.site.register(PipelineRun)
+admin.site.register(PipelineStage)
 admin.site.register(Question)
 admin.site.register(Student)
 admin.site.register(Submission)
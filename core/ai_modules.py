@@ -1,55 +1,340 @@
 import os
 import re
+import time
+import hashlib
+import subprocess
 import whisper
 import json
+import threading
 import warnings
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
 from dotenv import load_dotenv
+from django.db import connection, transaction
+from django.db.models import Count
 from openai import OpenAI
-from .models import Lecture, Question
+from . import asr, page_cache, telemetry
+from .grading import invalidate_lecture_results
+from .llm_cache import CachedOpenAIClient
+from .models import Lecture, LectureChunk, Question
 load_dotenv()
 
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")  # gpt-4o 使用的 tokenizer
+except ImportError:
+    _encoding = None
 
-def transcribe_with_whisper(audio_path, model_size="small"):
+SUMMARY_CONCURRENCY = int(os.getenv("SUMMARY_CONCURRENCY", "4"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "800"))
+CHUNK_MIN_TOKENS = int(os.getenv("CHUNK_MIN_TOKENS", "200"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "0"))
+QUESTION_STREAMING = os.getenv("QUESTION_STREAMING", "1") == "1"
+LIVE_MIN_SECONDS = float(os.getenv("LIVE_MIN_SECONDS", "30"))
+LIVE_GUARD_SECONDS = float(os.getenv("LIVE_GUARD_SECONDS", "3"))
+REDUCE_FAN_IN = int(os.getenv("REDUCE_FAN_IN", "8"))
+REDUCE_TOKEN_BUDGET = int(os.getenv("REDUCE_TOKEN_BUDGET", "3000"))
+REDUCE_MAX_DEPTH = int(os.getenv("REDUCE_MAX_DEPTH", "4"))
+
+_CJK_RE = re.compile(r'[\u3000-\u9fff\uf900-\ufaff\uff00-\uffef]')
+
+
+def count_tokens(text):
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    # 沒有安裝 tiktoken 時粗估：中日文約每字 1 token，其餘約每 4 字元 1 token
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class WhisperModelRegistry:
+    """每個 worker 行程內共用的 Whisper 模型快取（LRU，執行緒安全）。"""
+
+    def __init__(self, max_models=1):
+        self.max_models = max(1, max_models)
+        self._models = OrderedDict()  # model_size -> (model, inference_lock)
+        self._lock = threading.Lock()
+        self._load_locks = {}
+
+    def _load_lock(self, model_size):
+        with self._lock:
+            return self._load_locks.setdefault(model_size, threading.Lock())
+
+    def get(self, model_size):
+        """回傳 (model, inference_lock, load_seconds)；已載入的模型 load_seconds 為 0。"""
+        with self._lock:
+            if model_size in self._models:
+                self._models.move_to_end(model_size)
+                model, inference_lock = self._models[model_size]
+                return model, inference_lock, 0.0
+
+        # 同一個 size 只允許一個執行緒載入，其他執行緒等待後直接取用
+        with self._load_lock(model_size):
+            with self._lock:
+                if model_size in self._models:
+                    self._models.move_to_end(model_size)
+                    model, inference_lock = self._models[model_size]
+                    return model, inference_lock, 0.0
+                # 先淘汰再載入，避免同時在記憶體中多放一份權重
+                while len(self._models) >= self.max_models:
+                    evicted, _ = self._models.popitem(last=False)
+                    print(f"♻️ 釋放 Whisper 模型：{evicted}")
+
+            started = time.perf_counter()
+            model = whisper.load_model(model_size)
+            load_seconds = time.perf_counter() - started
+            print(f"✅ Whisper 模型 {model_size} 載入完成（{load_seconds:.1f}s）")
+
+            entry = (model, threading.Lock())
+            with self._lock:
+                self._models[model_size] = entry
+                while len(self._models) > self.max_models:
+                    evicted, _ = self._models.popitem(last=False)
+                    print(f"♻️ 釋放 Whisper 模型：{evicted}")
+            return entry[0], entry[1], load_seconds
+
+    def warm_up(self, model_sizes):
+        for model_size in model_sizes:
+            self.get(model_size)
+
+    def loaded_sizes(self):
+        with self._lock:
+            return list(self._models)
+
+
+whisper_models = WhisperModelRegistry(
+    max_models=int(os.getenv("WHISPER_MAX_MODELS", "1"))
+)
+
+
+def warm_up_whisper_models():
+    # 由 WHISPER_WARMUP_MODELS（逗號分隔，例如 "small,base"）指定 worker 啟動時預先載入的模型
+    sizes = [s.strip() for s in os.getenv("WHISPER_WARMUP_MODELS", "").split(",") if s.strip()]
+    if sizes:
+        print(f"🔥 預先載入 Whisper 模型：{', '.join(sizes)}")
+        whisper_models.warm_up(sizes)
+
+
+def transcribe_segments(audio, model_size="small", timings=None, offset_seconds=0.0):
+    """VAD 切段後轉錄已解碼的音訊，回傳 (逐字稿, 時間軸片段)。"""
     try:
         warnings.filterwarnings("ignore", message=".*FP16 is not supported on CPU.*")
-        if not os.path.exists(audio_path):
-            print(f"❌ 找不到音訊檔案：{audio_path}")
-            return None
-        model = whisper.load_model(model_size)
-        print("✅ Whisper 轉錄開始")
-        result = model.transcribe(audio_path, fp16=False)
-        return result["text"]
+        load_seconds = 0.0
+        print(f"✅ Whisper 分段轉錄開始（{asr.ASR_PROCESSES} 個行程）")
+        started = time.perf_counter()
+        if asr.ASR_PROCESSES <= 1:
+            model, inference_lock, load_seconds = whisper_models.get(model_size)
+            started = time.perf_counter()
+            with inference_lock:
+                text, segments, stats = asr.transcribe_audio(audio, model_size, model=model,
+                                                             offset_seconds=offset_seconds)
+        else:
+            text, segments, stats = asr.transcribe_audio(audio, model_size, offset_seconds=offset_seconds)
+        inference_seconds = time.perf_counter() - started
+        rtf = inference_seconds / stats["audio_seconds"] if stats["audio_seconds"] else 0
+        print(f"⏱️ Whisper 載入 {load_seconds:.1f}s / 轉錄 {inference_seconds:.1f}s"
+              f"（語音 {stats['speech_seconds']:.0f}/{stats['audio_seconds']:.0f}s，{stats['segments']} 段，RTF {rtf:.2f}）")
+        if timings is not None:
+            timings.update(stats)
+            timings["model_size"] = model_size
+            timings["whisper_load_seconds"] = load_seconds
+            timings["whisper_inference_seconds"] = inference_seconds
+        return text, segments
     except Exception as e:
         print(f"❌ Whisper 轉錄錯誤: {e}")
-        return None
-
-
-def dynamic_split(text, min_length=300, max_length=1000):
-    text = text.strip()
-    if len(text) <= max_length:
-        return [text]
-    paragraphs = re.split(r'(?<=[。！？])\s*', text)
-    chunks, temp = [], ""
-    for para in paragraphs:
-        if len(temp) + len(para) <= max_length:
-            temp += para
-        else:
-            if len(temp) >= min_length:
-                chunks.append(temp.strip())
-                temp = para
+        return None, []
+
+
+def hash_file(path, block_size=1024 * 1024):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def decode_audio(audio_path, timings=None):
+    # ffmpeg 直接解碼成 16kHz 單聲道 float32 並以 pipe 讀進記憶體，不產生任何暫存檔；
+    # 解碼結果可直接交給 transcribe，音檔本身維持上傳時的壓縮格式
+    started = time.perf_counter()
+    audio = whisper.load_audio(audio_path)
+    if timings is not None:
+        timings["decode_seconds"] = time.perf_counter() - started
+        timings["stored_audio_bytes"] = os.path.getsize(audio_path)
+    return audio
+
+
+def decode_audio_from(audio_path, start_seconds):
+    """從 start_seconds 開始解碼到檔尾（格式同 decode_audio）；ffmpeg 以 -ss 跳過前段，不解碼已處理的音訊。"""
+    if start_seconds <= 0:
+        return decode_audio(audio_path)
+    cmd = [
+        "ffmpeg", "-nostdin", "-threads", "0", "-ss", f"{start_seconds:.3f}", "-i", audio_path,
+        "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(asr.SAMPLE_RATE), "-",
+    ]
+    try:
+        out = subprocess.run(cmd, capture_output=True, check=True).stdout
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"ffmpeg 解碼失敗：{e.stderr.decode(errors='replace')}") from e
+    return np.frombuffer(out, np.int16).flatten().astype(np.float32) / 32768.0
+
+
+def print_decode_report(timings):
+    """每份錄音印一次實測的解碼時間與存檔大小；與舊 WAV 暫存檔流程的比較請執行 manage.py benchmark_decode。"""
+    if "decode_seconds" not in timings:
+        return
+    print(f"🎧 解碼 {timings['decode_seconds']:.1f}s，存檔 {timings['stored_audio_bytes'] / 1e6:.1f} MB")
+
+
+def pcm_fingerprint(audio):
+    return hashlib.sha256(audio.tobytes()).hexdigest()
+
+
+def find_transcribed_duplicate(lecture):
+    # 相同檔案或相同解碼內容、且已有逐字稿的其他講次
+    done = Lecture.objects.exclude(pk=lecture.pk).exclude(transcript='')
+    if lecture.audio_sha256:
+        match = done.filter(audio_sha256=lecture.audio_sha256).first()
+        if match:
+            return match
+    if lecture.pcm_sha256:
+        return done.filter(pcm_sha256=lecture.pcm_sha256).first()
+    return None
+
+
+_SENTENCE_END_RE = re.compile(r'(?<=[。！？!?])')
+_WHITESPACE_RE = re.compile(r'(?<=\s)')
+
+
+def _hard_split(unit, tokens, max_tokens):
+    # 完全沒有標點與空白時，依 token 數換算字元長度直接切段
+    size = max(1, len(unit) * max_tokens // tokens)
+    return [unit[i:i + size] for i in range(0, len(unit), size)]
+
+
+def _split_units(text, max_tokens):
+    """把文字切成不超過 max_tokens 的單位：先依句末標點，太長再依空白，最後硬切。"""
+    units = []
+    for sentence in _SENTENCE_END_RE.split(text):
+        if not sentence:
+            continue
+        tokens = count_tokens(sentence)
+        if tokens <= max_tokens:
+            units.append((sentence, tokens))
+            continue
+        for piece in _WHITESPACE_RE.split(sentence):
+            if not piece:
+                continue
+            piece_tokens = count_tokens(piece)
+            if piece_tokens <= max_tokens:
+                units.append((piece, piece_tokens))
             else:
-                temp += para
-    if temp:
-        chunks.append(temp.strip())
-    return chunks
+                units.extend((p, count_tokens(p)) for p in _hard_split(piece, piece_tokens, max_tokens))
+    return units
 
 
-def create_openai_client():
+def split_transcript(text, max_tokens=CHUNK_MAX_TOKENS, min_tokens=CHUNK_MIN_TOKENS,
+                     overlap_tokens=CHUNK_OVERLAP_TOKENS, segments=None):
+    """依 token 數把逐字稿切成段落，線性時間（每個單位只計算一次 token、以 list 暫存再 join）。
+
+    segments 為 Whisper 時間軸片段時，以片段邊界作為最外層的切點；
+    overlap_tokens > 0 時，每段開頭會帶入上一段結尾約該數量的 token。
+    """
+    if overlap_tokens > max_tokens // 2:
+        # 重疊太大時每段只往前推進一兩句，段數與 LLM 呼叫次數會暴增
+        print(f"⚠️ CHUNK_OVERLAP_TOKENS={overlap_tokens} 過大，改用 {max_tokens // 2}（段落上限的一半）")
+        overlap_tokens = max_tokens // 2
+    if segments:
+        units = [u for seg in segments for u in _split_units(seg["text"] + " ", max_tokens)]
+    else:
+        units = _split_units(text.strip(), max_tokens)
+    if not units:
+        return []
+
+    chunks, buffer, buffer_tokens = [], [], 0
+    for unit, tokens in units:
+        if buffer and buffer_tokens + tokens > max_tokens:
+            chunks.append(("".join(u for u, _ in buffer).strip(), buffer_tokens))
+            carried, carried_tokens = [], 0
+            if overlap_tokens > 0:
+                for u, t in reversed(buffer):
+                    if carried_tokens + t > overlap_tokens or carried_tokens + t + tokens > max_tokens:
+                        break
+                    carried.append((u, t))
+                    carried_tokens += t
+                carried.reverse()
+            buffer, buffer_tokens = carried, carried_tokens
+        buffer.append((unit, tokens))
+        buffer_tokens += tokens
+    chunks.append(("".join(u for u, _ in buffer).strip(), buffer_tokens))
+
+    # 最後一段太短時併入前一段（不超過上限的情況下）
+    if len(chunks) > 1 and chunks[-1][1] < min_tokens and chunks[-2][1] + chunks[-1][1] <= max_tokens:
+        last_text, last_tokens = chunks.pop()
+        chunks[-1] = (chunks[-1][0] + last_text, chunks[-1][1] + last_tokens)
+    return [chunk for chunk, _ in chunks if chunk]
+
+
+def create_openai_client(recorder=None):
     api_key = os.getenv("OPENAI_API_KEY")
     api_base = os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1")
     if not api_key or api_key.strip().upper() == "EMPTY":
         raise ValueError("❌ 請設定 OPENAI_API_KEY")
-    return OpenAI(api_key=api_key, base_url=api_base)
+    client = OpenAI(api_key=api_key, base_url=api_base)
+    if recorder is not None:
+        # 紀錄包在快取內層，只記錄實際送出的請求
+        client = telemetry.TracedOpenAIClient(client, recorder)
+    return CachedOpenAIClient(client)
+
+
+def run_in_pool_thread(fn, *args, **kwargs):
+    # 執行緒池裡的工作會開自己的資料庫連線（例如 LLM 快取），結束時關閉避免連線殘留
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        connection.close()
+
+
+def invalidate_cached_response(client, params):
+    """回應解析失敗時刪除對應的 LLM 快取，重試才會拿到新的回應（未包快取的 client 直接略過）。"""
+    invalidate = getattr(client.chat.completions, "invalidate", None)
+    if invalidate is not None:
+        invalidate(**params)
+
+
+def completion_text(client, params):
+    # 摘要類請求：內容為空時視為失敗並清掉快取，交給 call_with_retries 重試
+    response = client.chat.completions.create(**params)
+    content = (response.choices[0].message.content or "").strip()
+    if not content:
+        invalidate_cached_response(client, params)
+        raise ValueError("模型回傳空白內容")
+    return content
+
+
+# LLM 請求在執行紀錄中的分類
+LLM_CALL_NAMES = {
+    'generate_summary_for_chunk': 'summary',
+    'merge_summary_batch': 'reduce',
+    'combine_summaries': 'combine',
+}
+
+
+def call_with_retries(label, fn, *args, **kwargs):
+    name = LLM_CALL_NAMES.get(fn.__name__, fn.__name__)
+    for attempt in range(1, LLM_MAX_RETRIES + 1):
+        try:
+            with telemetry.llm_call(name, label, attempt):
+                return fn(*args, **kwargs)
+        except Exception as e:
+            if attempt == LLM_MAX_RETRIES:
+                print(f"❌ {label}失敗（已重試 {attempt} 次）: {e}")
+                raise
+            delay = 2 ** (attempt - 1)
+            print(f"⚠️ {label}失敗（第 {attempt} 次），{delay} 秒後重試: {e}")
+            time.sleep(delay)
 
 
 def generate_summary_for_chunk(client, chunk, chunk_index, total_chunks):
@@ -61,17 +346,60 @@ def generate_summary_for_chunk(client, chunk, chunk_index, total_chunks):
 總字數控制在 150 字內。"""},
         {"role": "user", "content": chunk}
     ]
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=prompt,
-            temperature=0.3,
-            max_tokens=400
-        )
-        return response.choices[0].message.content.strip()
-    except Exception as e:
-        print(f"❌ 段落摘要錯誤: {e}")
-        return f"第 {chunk_index + 1} 段摘要失敗"
+    return completion_text(client, dict(
+        model="gpt-4o",
+        messages=prompt,
+        temperature=0.3,
+        max_tokens=400
+    ))
+
+
+def chunk_hash(chunk, chunk_index):
+    # 摘要 prompt 含段落序號，因此序號也納入雜湊
+    return hashlib.sha256(f"{chunk_index}\n{chunk}".encode("utf-8")).hexdigest()
+
+
+def summarize_chunks(client, chunks, max_workers=SUMMARY_CONCURRENCY, known=None, on_done=None):
+    # 各段摘要互不相依，以執行緒池並行送出；結果依段落順序回傳，失敗的段落各自重試
+    # known：{chunk_hash: summary}，已有摘要的段落直接沿用
+    # on_done(index, summary)：每段完成時在呼叫端執行緒回呼，用來即時存檔
+    if not chunks:
+        return []
+    known = known or {}
+    hashes = [chunk_hash(c, i) for i, c in enumerate(chunks)]
+    summaries = [known.get(h) for h in hashes]
+    pending = [i for i, summary in enumerate(summaries) if summary is None]
+    if not pending:
+        print(f"♻️ {len(chunks)} 段摘要全部沿用既有結果")
+        return summaries
+
+    workers = max(1, min(max_workers, len(pending)))
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(run_in_pool_thread, call_with_retries, f"第 {i + 1} 段摘要",
+                        generate_summary_for_chunk, client, chunks[i], i, len(chunks)): i
+            for i in pending
+        }
+        try:
+            for f in as_completed(futures):
+                i = futures[f]
+                summaries[i] = f.result()
+                if on_done:
+                    on_done(i, summaries[i])
+        except Exception:
+            for f in futures:
+                f.cancel()
+            raise
+    print(f"⏱️ {len(pending)}/{len(chunks)} 段摘要完成（並行 {workers}，{time.perf_counter() - started:.1f}s）")
+    return summaries
+
+
+def store_chunk_summary(lecture, chunk, chunk_index, summary):
+    LectureChunk.objects.update_or_create(
+        lecture=lecture, index=chunk_index,
+        defaults={'chunk_hash': chunk_hash(chunk, chunk_index), 'summary': summary},
+    )
 
 
 def combine_summaries(client, summaries):
@@ -86,21 +414,116 @@ def combine_summaries(client, summaries):
 請使用繁體中文，避免重複敘述，控制總字數在 400 字內。"""},
         {"role": "user", "content": combined}
     ]
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=prompt,
-            temperature=0.3,
-            max_tokens=512
-        )
-        return response.choices[0].message.content.strip()
-    except Exception as e:
-        print(f"❌ 總結錯誤: {e}")
-        return "整合摘要失敗"
+    return completion_text(client, dict(
+        model="gpt-4o",
+        messages=prompt,
+        temperature=0.3,
+        max_tokens=512
+    ))
 
 
-def generate_quiz(client, summary, count=3):
+def merge_summary_batch(client, summaries):
+    combined = "\n\n".join([f"段落 {i+1}：{s}" for i, s in enumerate(summaries)])
     prompt = [
+        {"role": "system", "content": """你是一位專業的繁體中文課程摘要設計師。
+下列是同一堂課中連續幾段內容的摘要，請合併為一份摘要，包含：
+- 簡潔內容概述（80–120字）
+- 3–5 個學習要點，使用條列式
+保留原本的先後順序，避免重複，總字數控制在 250 字內。"""},
+        {"role": "user", "content": combined}
+    ]
+    return completion_text(client, dict(
+        model="gpt-4o",
+        messages=prompt,
+        temperature=0.3,
+        max_tokens=600
+    ))
+
+
+def batch_summaries(summaries, fan_in=REDUCE_FAN_IN, token_budget=REDUCE_TOKEN_BUDGET):
+    # 依序把摘要裝進批次，每批不超過 fan_in 則且不超過 token_budget（單則超過預算時自成一批）
+    batches, current, current_tokens = [], [], 0
+    for summary in summaries:
+        tokens = count_tokens(summary)
+        if current and (len(current) >= fan_in or current_tokens + tokens > token_budget):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(summary)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def truncate_tokens(text, max_tokens):
+    """截斷到最多 max_tokens 個 token（計法同 count_tokens）。"""
+    tokens = count_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    if _encoding is not None:
+        return _encoding.decode(_encoding.encode(text, disallowed_special=())[:max_tokens])
+    return text[:max(0, len(text) * max_tokens // tokens)]
+
+
+def fit_token_budget(summaries, token_budget):
+    # 平均分配預算，只截斷超出各自份額的摘要
+    share = max(1, token_budget // len(summaries))
+    return [truncate_tokens(s, share) for s in summaries]
+
+
+def hierarchical_combine(client, summaries, fan_in=REDUCE_FAN_IN, token_budget=REDUCE_TOKEN_BUDGET,
+                         max_depth=REDUCE_MAX_DEPTH, timings=None):
+    """逐層把分段摘要分批合併（每層各批並行），直到全部放得進一個批次，再產生最終課程摘要。
+
+    單則超過預算的摘要也會自成一批再合併一次；到 max_depth 層仍放不下時，
+    送出最終整合前先截斷，確保最後一次請求不超過 token_budget。
+    """
+    fan_in = max(2, fan_in)
+    level_timings = []
+    for level in range(1, max_depth + 1):
+        if len(summaries) <= fan_in and sum(count_tokens(s) for s in summaries) <= token_budget:
+            break
+        batches = batch_summaries(summaries, fan_in, token_budget)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, min(SUMMARY_CONCURRENCY, len(batches)))) as pool:
+            futures = [
+                pool.submit(run_in_pool_thread, call_with_retries, f"第 {level} 層第 {i + 1} 批合併",
+                            merge_summary_batch, client, batch)
+                for i, batch in enumerate(batches)
+            ]
+            summaries = [f.result() for f in futures]
+        elapsed = time.perf_counter() - started
+        level_timings.append({"level": level, "batches": len(batches), "seconds": elapsed})
+        print(f"⏱️ 第 {level} 層合併：{len(batches)} 批（{elapsed:.1f}s）")
+
+    if sum(count_tokens(s) for s in summaries) > token_budget:
+        print(f"⚠️ 合併 {max_depth} 層後仍超過 {token_budget} tokens，截斷後再整合")
+        summaries = fit_token_budget(summaries, token_budget)
+
+    started = time.perf_counter()
+    final_summary = call_with_retries("整合摘要", combine_summaries, client, summaries)
+    elapsed = time.perf_counter() - started
+    level_timings.append({"level": len(level_timings) + 1, "batches": 1, "seconds": elapsed})
+    print(f"⏱️ 整合摘要（{len(summaries)} 則輸入，{elapsed:.1f}s）")
+    if timings is not None:
+        timings["reduce_levels"] = level_timings
+    return final_summary
+
+
+def parse_json_array(content):
+    # 模型偶爾會包上 ```json 區塊或回傳 {"questions": [...]}，統一取出題目陣列
+    content = content.strip()
+    if content.startswith("```"):
+        content = re.sub(r'^```[a-zA-Z]*\s*|\s*```$', '', content)
+    data = json.loads(content)
+    if isinstance(data, dict):
+        lists = [v for v in data.values() if isinstance(v, list)]
+        data = lists[0] if len(lists) == 1 else [data]
+    return data
+
+
+def mcq_prompt(summary, count):
+    return [
         {
             "role": "system",
             "content": f"""你是一位課程出題 AI，請根據以下課程摘要產生 {count} 題選擇題，格式如下：
@@ -123,22 +546,10 @@ def generate_quiz(client, summary, count=3):
         },
         {"role": "user", "content": summary}
     ]
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=prompt,
-            temperature=0.5,
-            max_tokens=1500
-        )
-        return json.loads(response.choices[0].message.content.strip())
-
-    except Exception as e:
-        print(f"❌ 選擇題產生失敗：{e}")
-        return []
 
 
-def generate_tf_questions(client, summary, count):
-    prompt = [
+def tf_prompt(summary, count):
+    return [
         {
             "role": "system",
             "content": f"""請根據以下課程摘要，設計 {count} 題是非題（True/False），格式如下：
@@ -155,80 +566,475 @@ def generate_tf_questions(client, summary, count):
         },
         {"role": "user", "content": summary}
     ]
+
+
+def generate_quiz(client, summary, count=3, model="gpt-4o", max_tokens=1500, bypass_cache=False):
+    params = dict(
+        model=model,
+        messages=mcq_prompt(summary, count),
+        temperature=0.5,
+        max_tokens=max_tokens,
+    )
     try:
-        response = client.chat.completions.create(
-            model="gpt-4",
-            messages=prompt,
-            temperature=0.5
-        )
-        return json.loads(response.choices[0].message.content)
+        response = client.chat.completions.create(**params, bypass_cache=bypass_cache)
+    except Exception as e:
+        print(f"❌ 選擇題產生失敗：{e}")
+        return []
+    try:
+        return parse_json_array(response.choices[0].message.content or "")
+    except ValueError as e:
+        invalidate_cached_response(client, params)
+        print(f"❌ 選擇題格式錯誤：{e}")
+        return []
+
+
+def generate_tf_questions(client, summary, count, model="gpt-4o", max_tokens=1000, bypass_cache=False):
+    params = dict(
+        model=model,
+        messages=tf_prompt(summary, count),
+        temperature=0.5,
+        max_tokens=max_tokens,
+    )
+    try:
+        response = client.chat.completions.create(**params, bypass_cache=bypass_cache)
     except Exception as e:
         print(f"❌ 是非題產生失敗：{e}")
         return []
+    try:
+        return parse_json_array(response.choices[0].message.content or "")
+    except ValueError as e:
+        invalidate_cached_response(client, params)
+        print(f"❌ 是非題格式錯誤：{e}")
+        return []
+
+
+# 各題型的 prompt、產生函式與模型／token 預算，可由環境變數個別調整
+QUESTION_TYPES = {
+    'mcq': {
+        'prompt': mcq_prompt,
+        'generator': generate_quiz,
+        'model': os.getenv("MCQ_MODEL", "gpt-4o"),
+        'max_tokens': int(os.getenv("MCQ_MAX_TOKENS", "1500")),
+    },
+    'tf': {
+        'prompt': tf_prompt,
+        'generator': generate_tf_questions,
+        'model': os.getenv("TF_MODEL", "gpt-4o"),
+        'max_tokens': int(os.getenv("TF_MAX_TOKENS", "1000")),
+    },
+}
+
+
+class JsonArrayStreamParser:
+    """逐段餵入模型輸出，每當 JSON 陣列中的一個物件收到結尾大括號就回傳該物件。"""
+
+    def __init__(self):
+        self._depth = 0
+        self._array_depth = None
+        self._in_string = False
+        self._escape = False
+        self._buffer = []
+
+    def feed(self, text):
+        objects = []
+        for ch in text:
+            capturing = bool(self._buffer)
+            if capturing:
+                self._buffer.append(ch)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+            if ch == '"':
+                self._in_string = True
+            elif ch in '[{':
+                if ch == '[' and self._array_depth is None:
+                    self._array_depth = self._depth + 1
+                elif ch == '{' and self._depth == self._array_depth and not capturing:
+                    self._buffer.append(ch)
+                self._depth += 1
+            elif ch in ']}':
+                self._depth -= 1
+                if capturing and self._depth == self._array_depth:
+                    raw = "".join(self._buffer)
+                    self._buffer = []
+                    try:
+                        objects.append(json.loads(raw))
+                    except json.JSONDecodeError:
+                        objects.append(raw)  # 交給驗證流程記錄為格式錯誤
+        return objects
+
+
+def stream_and_store_questions(client, lecture, question_type, count, bypass_cache=False):
+    """以串流方式出題，每收到一題完整的 JSON 物件就驗證並存檔。"""
+    config = QUESTION_TYPES[question_type]
+    parser = JsonArrayStreamParser()
+    created_ids, rejected = [], []
+    params = dict(
+        model=config['model'],
+        messages=config['prompt'](lecture.summary, count),
+        temperature=0.5,
+        max_tokens=config['max_tokens'],
+        stream=True,
+    )
+    started = time.perf_counter()
+    first_question_seconds = None
+    try:
+        stream = client.chat.completions.create(**params, bypass_cache=bypass_cache)
+        for chunk in stream:
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            for item in parser.feed(chunk.choices[0].delta.content):
+                index = len(created_ids) + len(rejected) + 1
+                try:
+                    question = build_question(item, lecture, question_type)
+                except ValueError as e:
+                    rejected.append((index, str(e)))
+                    continue
+                question.save()
+                created_ids.append(question.id)
+                if first_question_seconds is None:
+                    first_question_seconds = time.perf_counter() - started
+    except Exception as e:
+        # 已存的題目保留（刪除會連帶刪掉學生作答），往上丟讓工作重試，重跑時依題數只補缺少的部分
+        print(f"❌ {question_type.upper()} 串流出題失敗（已存 {len(created_ids)} 題）：{e}")
+        raise
+    if rejected:
+        # 有題目格式不符時不沿用這份回應，下次出題重新產生
+        invalidate_cached_response(client, params)
+    for index, reason in rejected:
+        print(f"⚠️ 第 {index} 題剔除：{reason}")
+    return {
+        'stored': len(created_ids),
+        'rejected': rejected,
+        'seconds': time.perf_counter() - started,
+        'first_question_seconds': first_question_seconds,
+    }
+
+
+def generate_and_store_questions(client, lecture, question_type, count, bypass_cache=False):
+    with telemetry.llm_call(question_type, f"{question_type.upper()} 出題 {count} 題"):
+        if QUESTION_STREAMING:
+            return stream_and_store_questions(client, lecture, question_type, count, bypass_cache)
+        config = QUESTION_TYPES[question_type]
+        started = time.perf_counter()
+        data = config['generator'](client, lecture.summary, count, model=config['model'],
+                                   max_tokens=config['max_tokens'], bypass_cache=bypass_cache)
+    stored, rejected = parse_and_store_questions(lecture.summary, data, lecture, question_type) if data else (0, [])
+    seconds = time.perf_counter() - started
+    return {'stored': stored, 'rejected': rejected, 'seconds': seconds,
+            'first_question_seconds': seconds if stored else None}
+
+
+def generate_questions(client, lecture, counts, bypass_cache=False):
+    """同時送出所有題型的出題請求並存檔，回傳 {題型: 統計}（含存入題數、耗時與第一題出現時間）。"""
+    requested = {t: n for t, n in counts.items() if n > 0}
+    if not requested:
+        return {}
+    with ThreadPoolExecutor(max_workers=len(requested)) as pool:
+        futures = {
+            t: pool.submit(run_in_pool_thread, generate_and_store_questions, client, lecture, t, n, bypass_cache)
+            for t, n in requested.items()
+        }
+        results = {t: f.result() for t, f in futures.items()}
+    for t, stats in results.items():
+        first = stats['first_question_seconds']
+        print(f"⏱️ {t} 出題 {stats['stored']} 題（{QUESTION_TYPES[t]['model']}，{stats['seconds']:.1f}s，"
+              f"第一題 {f'{first:.1f}s' if first is not None else '—'}）")
+    return results
+
+
+MCQ_OPTION_KEYS = ('A', 'B', 'C', 'D')
+_TF_ANSWERS = {
+    'true': 'True', 't': 'True', 'o': 'True', '對': 'True', '是': 'True', '正確': 'True',
+    'false': 'False', 'f': 'False', 'x': 'False', '錯': 'False', '否': 'False', '錯誤': 'False',
+}
+
+
+def _text(item, key, max_length=None):
+    value = item.get(key)
+    if value is None:
+        return ''
+    if not isinstance(value, (str, int, float)):
+        raise ValueError(f"{key} 不是文字")
+    value = str(value).strip()
+    if max_length and len(value) > max_length:
+        raise ValueError(f"{key} 超過 {max_length} 字")
+    return value
+
+
+_ANSWER_PREFIX_RE = re.compile(r'^\s*(?:correct\s+)?(?:answer|ans|正確答案|答案|答)\s*(?:is)?\s*[:：是為]?\s*', re.IGNORECASE)
+_MCQ_LETTER_RE = re.compile(r'(?<![A-Z])([A-D])(?![A-Z])')
+
+
+def _mcq_answer(raw):
+    """取出單獨的一個 A–D 選項字母（容許「Answer: B」「(C)」「答案：D」）；找不到時回傳 None。"""
+    letters = _MCQ_LETTER_RE.findall(_ANSWER_PREFIX_RE.sub('', raw).upper())
+    return letters[0] if len(set(letters)) == 1 else None
+
+
+def build_question(item, lecture, question_type):
+    """檢查單一題目並轉成未存檔的 Question；格式不符時丟出 ValueError 說明原因。"""
+    if not isinstance(item, dict):
+        raise ValueError("不是 JSON 物件")
+    question_text = _text(item, 'question')
+    if not question_text:
+        raise ValueError("缺少題目內容")
+    concept = _text(item, 'concept')[:100] or "未分類"
+    explanation = _text(item, 'explanation')
+
+    if question_type == 'mcq':
+        options = item.get('options')
+        if not isinstance(options, dict):
+            raise ValueError("缺少 options")
+        options = {str(k).strip().upper(): v for k, v in options.items()}
+        values = {}
+        for key in MCQ_OPTION_KEYS:
+            values[key] = _text(options, key, max_length=200)
+            if not values[key]:
+                raise ValueError(f"缺少選項 {key}")
+        answer = _mcq_answer(_text(item, 'answer'))
+        if answer is None:
+            raise ValueError(f"答案不是 A–D：{item.get('answer')!r}")
+        return Question(
+            lecture=lecture,
+            question_text=question_text,
+            option_a=values['A'],
+            option_b=values['B'],
+            option_c=values['C'],
+            option_d=values['D'],
+            correct_answer=answer,
+            explanation=explanation,
+            concept=concept,
+            question_type='mcq'
+        )
+
+    if question_type == 'tf':
+        raw = item.get('answer')
+        answer = ('True' if raw else 'False') if isinstance(raw, bool) else _TF_ANSWERS.get(str(raw).strip().lower())
+        if answer is None:
+            raise ValueError(f"答案不是 True/False：{raw!r}")
+        return Question(
+            lecture=lecture,
+            question_text=question_text,
+            correct_answer=answer,
+            explanation=explanation,
+            concept=concept,
+            question_type='tf'
+        )
+
+    raise ValueError(f"未知題型：{question_type}")
+
+
+def build_questions(quiz_data, lecture, question_type):
+    """回傳 (可存檔的 Question 清單, [(題號, 剔除原因), ...])。"""
+    questions, rejected = [], []
+    for index, item in enumerate(quiz_data, start=1):
+        try:
+            questions.append(build_question(item, lecture, question_type))
+        except ValueError as e:
+            rejected.append((index, str(e)))
+    return questions, rejected
 
 
 def parse_and_store_questions(summary, quiz_data, lecture, question_type):
-    for item in quiz_data:
-        question_text = item.get('question', '').strip()
-        explanation = item.get('explanation', '').strip()
-        answer = item.get('answer', '').strip()
-
-        if question_type == 'mcq':
-            options = item.get('options', {})
-            Question.objects.create(
-                lecture=lecture,
-                question_text=question_text,
-                option_a=options.get('A'),
-                option_b=options.get('B'),
-                option_c=options.get('C'),
-                option_d=options.get('D'),
-                correct_answer=answer,
-                explanation=explanation,
-                question_type='mcq'
-            )
-        elif question_type == 'tf':
-                Question.objects.create(
-                    lecture=lecture,
-                    question_text=item.get('question', '').strip(),
-                    correct_answer=item.get('answer'),
-                    explanation=item.get('explanation', '').strip(),
-                    question_type='tf'
-            )
-        else:
-            print(f"⚠️ 未知題型：{question_type}")
+    if not isinstance(quiz_data, list):
+        quiz_data = [quiz_data]
+    questions, rejected = build_questions(quiz_data, lecture, question_type)
+    with transaction.atomic():
+        Question.objects.bulk_create(questions)
+    # bulk_create 不觸發 post_save，需自行讓題目解析與頁面片段快取失效
+    invalidate_lecture_results(lecture.id)
+    page_cache.invalidate('lecture', lecture.id)
+    print(f"✅ 已存入 {len(questions)} 題 {question_type.upper()}，剔除 {len(rejected)} 題")
+    for index, reason in rejected:
+        print(f"⚠️ 第 {index} 題剔除：{reason}")
+    return len(questions), rejected
 
 
-def process_audio_and_generate_quiz(lecture_id, num_mcq=3, num_tf=0):
+def segments_text(segments):
+    return "\n".join(seg["text"] for seg in segments if seg["text"])
+
+
+def transcribe_live_recording(lecture_id):
+    """錄音進行中：只轉錄已結束（後面接著靜音）的語音區段，並先摘要不會再變動的段落。"""
     lecture = Lecture.objects.get(id=lecture_id)
-    client = create_openai_client()
+    if lecture.status != 'recording' or not lecture.audio_file:
+        return
+
+    # 只解碼尚未轉錄的部分，錄音越長也不必每次重新解碼整個檔案
+    offset = int(lecture.live_transcribed_seconds * asr.SAMPLE_RATE)
+    tail = decode_audio_from(lecture.audio_file.path, offset / asr.SAMPLE_RATE)
+    # 最後幾秒可能還在說話，只取在此之前結束的區段
+    guard = len(tail) - int(LIVE_GUARD_SECONDS * asr.SAMPLE_RATE)
+    complete = [region for region in asr.detect_speech_regions(tail) if region[1] < guard]
+    if not complete:
+        return
+    cut = complete[-1][1]
+    if cut < LIVE_MIN_SECONDS * asr.SAMPLE_RATE:
+        return
 
-    print("🎧 開始語音轉錄")
-    transcript = transcribe_with_whisper(lecture.audio_file.path)
-    if not transcript:
+    text, segments = transcribe_segments(tail[:cut], offset_seconds=offset / asr.SAMPLE_RATE)
+    if text is None:
+        raise RuntimeError(f"講次 {lecture_id} 即時轉錄失敗")
+    all_segments = lecture.transcript_segments + segments
+    # 只有仍在錄音且沒有其他工作先寫入時才更新，避免與停止錄音後的完整處理重複
+    updated = Lecture.objects.filter(
+        pk=lecture.pk, status='recording', live_transcribed_seconds=lecture.live_transcribed_seconds
+    ).update(transcript_segments=all_segments, live_transcribed_seconds=(offset + cut) / asr.SAMPLE_RATE)
+    if not updated:
         return
-    lecture.transcript = transcript
-    lecture.save()
+    print(f"🎙️ 講次 {lecture_id} 即時轉錄至 {(offset + cut) / asr.SAMPLE_RATE:.0f}s")
+
+    # 最後一段還會隨新的逐字稿變長，其餘段落的內容已固定，可以先摘要
+    stable_chunks = split_transcript("", segments=all_segments)[:-1]
+    if stable_chunks:
+        client = create_openai_client()
+        hashes = [chunk_hash(c, i) for i, c in enumerate(stable_chunks)]
+        known = dict(LectureChunk.objects.filter(chunk_hash__in=hashes).values_list('chunk_hash', 'summary'))
+        summarize_chunks(client, stable_chunks, known=known,
+                         on_done=lambda i, summary: store_chunk_summary(lecture, stable_chunks[i], i, summary))
+
+
+def transcribe_lecture(lecture, timings=None):
+    """填入 lecture.transcript / transcript_segments（尚未存檔），回傳逐字稿；timings 收集 Whisper 統計。"""
+    audio_path = lecture.audio_file.path
+    if lecture.live_transcribed_seconds:
+        # 即時錄音已轉錄的部分直接沿用，只補轉錄剩下的尾段
+        audio = decode_audio(audio_path, timings)
+        offset = int(lecture.live_transcribed_seconds * asr.SAMPLE_RATE)
+        text, segments = transcribe_segments(audio[offset:], timings=timings,
+                                             offset_seconds=lecture.live_transcribed_seconds)
+        if text is None:
+            # 尾段轉錄失敗時不能只用已即時轉錄的部分完成，否則逐字稿會少掉最後一段
+            return None
+        lecture.transcript_segments = lecture.transcript_segments + segments
+        lecture.transcript = segments_text(lecture.transcript_segments)
+        return lecture.transcript
+    if not lecture.audio_sha256:
+        lecture.audio_sha256 = hash_file(audio_path)
+        lecture.save(update_fields=['audio_sha256'])
+
+    # 先比對檔案雜湊，找不到再解碼比對 PCM；解碼結果直接給 Whisper，不重複解碼
+    audio = None
+    duplicate = find_transcribed_duplicate(lecture)
+    if duplicate is None:
+        audio = decode_audio(audio_path, timings)
+        lecture.pcm_sha256 = pcm_fingerprint(audio)
+        lecture.save(update_fields=['pcm_sha256'])
+        duplicate = find_transcribed_duplicate(lecture)
+
+    if duplicate is not None:
+        print(f"♻️ 與講次 {duplicate.id} 音檔相同，沿用逐字稿")
+        lecture.pcm_sha256 = lecture.pcm_sha256 or duplicate.pcm_sha256
+        lecture.transcript = duplicate.transcript
+        lecture.transcript_segments = duplicate.transcript_segments
+    else:
+        lecture.transcript, lecture.transcript_segments = transcribe_segments(audio, timings=timings)
+    return lecture.transcript
+
+
+def summarize_transcript_chunks(client, lecture, transcript):
+    chunks = split_transcript(transcript, segments=lecture.transcript_segments)
+    hashes = [chunk_hash(c, i) for i, c in enumerate(chunks)]
+    known = dict(LectureChunk.objects.filter(chunk_hash__in=hashes).values_list('chunk_hash', 'summary'))
+    # 已存在且雜湊相符的段落不必重寫；逐字稿變短時刪掉多出來的舊段落
+    stored = set(LectureChunk.objects.filter(lecture=lecture).values_list('index', 'chunk_hash'))
+    LectureChunk.objects.filter(lecture=lecture, index__gte=len(chunks)).delete()
+
+    def on_done(i, summary):
+        store_chunk_summary(lecture, chunks[i], i, summary)
+        stored.add((i, hashes[i]))
+
+    summaries = summarize_chunks(client, chunks, known=known, on_done=on_done)
+    # 從其他講次沿用的段落也寫一份到本講次
+    for i, (c, summary) in enumerate(zip(chunks, summaries)):
+        if (i, hashes[i]) not in stored:
+            store_chunk_summary(lecture, c, i, summary)
+    return summaries
 
-    print("📝 開始摘要處理")
-    chunks = dynamic_split(transcript)
-    summaries = [generate_summary_for_chunk(client, c, i, len(chunks)) for i, c in enumerate(chunks)]
 
-    final_summary = combine_summaries(client, summaries)
-    lecture.summary = final_summary
-    lecture.save()
+def summaries_hash(summaries):
+    return hashlib.sha256("\n\0".join(summaries).encode("utf-8")).hexdigest()
 
-    print("🧠 開始產生考題")
 
-    if num_mcq > 0:
-        mcq_data = generate_quiz(client, final_summary, num_mcq)
-        if mcq_data:
-            parse_and_store_questions(final_summary, mcq_data, lecture, 'mcq')
+def set_lecture_status(lecture, status):
+    Lecture.objects.filter(pk=lecture.pk).update(status=status)
+    lecture.status = status
+
+
+def process_audio_and_generate_quiz(lecture_id, num_mcq=3, num_tf=0, regenerate_questions=False):
+    """依序執行轉錄 → 分段摘要 → 整合摘要 → 出題，每個階段完成即存檔。
+
+    重跑時從第一個未完成的階段繼續；regenerate_questions=True 時出題略過 LLM 快取，
+    確保老師要求重新出題時拿到新的題目（舊題目由呼叫端先刪除）。
+    每次執行都會寫入 PipelineRun / PipelineStage，記錄各階段耗時與 LLM 用量。
+    """
+    lecture = Lecture.objects.get(id=lecture_id)
+    with telemetry.pipeline_run(lecture) as recorder:
+        client = create_openai_client(recorder)
+
+        if lecture.transcript:
+            print("♻️ 已有逐字稿，略過語音轉錄")
         else:
-            print("⚠️ 沒有回傳 MCQ 題目")
+            print("🎧 開始語音轉錄")
+            set_lecture_status(lecture, 'transcribing')
+            timings = {}
+            with recorder.stage('transcribe', '語音轉錄'):
+                transcript = transcribe_lecture(lecture, timings)
+            recorder.record_transcription(timings)
+            print_decode_report(timings)
+            if not transcript:
+                raise RuntimeError(f"講次 {lecture_id} 語音轉錄失敗")
+            lecture.save(update_fields=['transcript', 'transcript_segments', 'pcm_sha256'])
 
-    if num_tf > 0:
-        tf_data = generate_tf_questions(client, final_summary, num_tf)
-        if tf_data:
-            parse_and_store_questions(final_summary, tf_data, lecture, 'tf')
+        print("📝 開始摘要處理")
+        set_lecture_status(lecture, 'summarizing')
+        with recorder.stage('summarize', '分段摘要'):
+            summaries = summarize_transcript_chunks(client, lecture, lecture.transcript)
+        recorder.run.transcript_chunks = len(summaries)
+        source_hash = summaries_hash(summaries)
+        if lecture.summary and lecture.summary_source_hash == source_hash:
+            print("♻️ 分段摘要未變動，沿用整合摘要")
         else:
-            print("⚠️ 沒有回傳 TF 題目")
+            reduce_timings = {}
+            with recorder.stage('combine', '整合摘要'):
+                lecture.summary = hierarchical_combine(client, summaries, timings=reduce_timings)
+            recorder.record_reduce(reduce_timings)
+            lecture.summary_source_hash = source_hash
+            lecture.save(update_fields=['summary', 'summary_source_hash'])
+
+        print("🧠 開始產生考題")
+        set_lecture_status(lecture, 'generating')
+        # 串流出題是逐題存檔，worker 中途被中斷時會留下不足數量的題目：依題數判斷，只補產生缺少的部分
+        # （不刪除已存的題目，學生可能已經作答）
+        existing = dict(
+            Question.objects.filter(lecture=lecture).order_by()
+            .values_list('question_type').annotate(n=Count('id'))
+        )
+        counts = {'mcq': num_mcq, 'tf': num_tf}
+        for question_type, requested in counts.items():
+            have = existing.get(question_type, 0)
+            if not have or not requested:
+                continue
+            if have >= requested:
+                print(f"♻️ 已有 {have} 題 {question_type.upper()}，略過")
+                counts[question_type] = 0
+            else:
+                print(f"♻️ 已有 {have}/{requested} 題 {question_type.upper()}，補產生 {requested - have} 題")
+                counts[question_type] = requested - have
+
+        with recorder.stage('questions', '出題'):
+            results = generate_questions(client, lecture, counts, bypass_cache=regenerate_questions)
+        for question_type, stats in results.items():
+            if not stats['stored']:
+                print(f"⚠️ 沒有回傳 {question_type.upper()} 題目")
+        if (num_mcq or num_tf) and not Question.objects.filter(lecture=lecture).exists():
+            # 一題都沒有時不標記完成，交給工作佇列重試
+            raise RuntimeError(f"講次 {lecture_id} 沒有產生任何題目")
+
+        set_lecture_status(lecture, 'done')
@@ -0,0 +1,153 @@
+# core/asr.py
+# 語音轉錄管線：能量式 VAD 切除靜音 → 合併成有長度上限的片段 → 多行程平行轉錄 → 依時間軸接回
+# 此模組不 import Django，spawn 出來的子行程可以直接載入
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import whisper
+
+SAMPLE_RATE = whisper.audio.SAMPLE_RATE
+
+ASR_PROCESSES = int(os.getenv("ASR_PROCESSES", "1"))
+ASR_SEGMENT_SECONDS = float(os.getenv("ASR_SEGMENT_SECONDS", "120"))
+WHISPER_LANGUAGE = os.getenv("WHISPER_LANGUAGE") or None
+
+
+def detect_speech_regions(audio, frame_ms=30, margin_db=12.0, dynamic_range_db=25.0, floor_db=-55.0,
+                          min_speech_ms=250, max_pause_ms=600, pad_ms=200):
+    """回傳 [(start_sample, end_sample), ...]，以音框能量高於背景噪音一定分貝視為語音。"""
+    frame = int(SAMPLE_RATE * frame_ms / 1000)
+    n_frames = len(audio) // frame
+    if n_frames == 0:
+        return [(0, len(audio))] if len(audio) else []
+
+    frames = audio[:n_frames * frame].reshape(n_frames, frame)
+    db = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+    # 背景噪音取低百分位；整段幾乎都在講話時低百分位也是語音，改以高百分位往下推一個動態範圍
+    noise, loud = np.percentile(db, 10), np.percentile(db, 95)
+    threshold = max(min(noise + margin_db, loud - dynamic_range_db), floor_db)
+    voiced = db > threshold
+
+    # 找出連續語音音框的起訖，短暫停頓合併、太短的雜訊丟棄
+    edges = np.diff(np.concatenate(([0], voiced.astype(np.int8), [0])))
+    starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    max_pause = max_pause_ms // frame_ms
+    min_speech = max(1, min_speech_ms // frame_ms)
+    pad = int(SAMPLE_RATE * pad_ms / 1000)
+
+    regions = []
+    for start, end in zip(starts, ends):
+        if regions and start - regions[-1][1] <= max_pause:
+            regions[-1][1] = end
+        else:
+            regions.append([start, end])
+    return [
+        (int(max(0, s * frame - pad)), int(min(len(audio), e * frame + pad)))
+        for s, e in regions if e - s >= min_speech
+    ]
+
+
+def group_regions(regions, max_seconds=ASR_SEGMENT_SECONDS, max_gap_seconds=2.0):
+    """把相鄰語音區段合併成不超過 max_seconds 的片段；長靜音處一律斷開。"""
+    max_len = int(max_seconds * SAMPLE_RATE)
+    max_gap = int(max_gap_seconds * SAMPLE_RATE)
+    segments = []
+    for start, end in regions:
+        # 單一區段本身就超過上限時切成等長小段
+        while end - start > max_len:
+            segments.append([start, start + max_len])
+            start += max_len
+        if segments and start - segments[-1][1] <= max_gap and end - segments[-1][0] <= max_len:
+            segments[-1][1] = max(segments[-1][1], end)
+        else:
+            segments.append([start, end])
+    return [tuple(s) for s in segments]
+
+
+_worker_model = None
+
+
+def _init_worker(model_size, torch_threads):
+    global _worker_model
+    import torch
+    torch.set_num_threads(torch_threads)
+    _worker_model = whisper.load_model(model_size)
+
+
+def _transcribe_samples(model, samples, offset, language):
+    cpu_started = time.process_time()
+    result = model.transcribe(samples, fp16=False, language=language)
+    cpu_seconds = time.process_time() - cpu_started
+    segments = [
+        {"start": round(offset + float(s["start"]), 2), "end": round(offset + float(s["end"]), 2),
+         "text": s["text"].strip()}
+        for s in result["segments"]
+    ]
+    return result["text"].strip(), segments, cpu_seconds
+
+
+def _transcribe_in_worker(samples, offset, language):
+    return _transcribe_samples(_worker_model, samples, offset, language)
+
+
+def create_asr_pool(model_size, processes):
+    # torch 已載入的行程不能安全 fork，一律用 spawn
+    torch_threads = max(1, (os.cpu_count() or 1) // processes)
+    return ProcessPoolExecutor(
+        max_workers=processes,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(model_size, torch_threads),
+    )
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_asr_pool(model_size, processes=ASR_PROCESSES):
+    # 每個 worker 行程共用一組常駐子行程，模型只在子行程啟動時載入一次
+    with _pools_lock:
+        key = (model_size, processes)
+        if key not in _pools:
+            _pools[key] = create_asr_pool(model_size, processes)
+        return _pools[key]
+
+
+def transcribe_audio(audio, model_size="small", processes=ASR_PROCESSES, model=None, pool=None,
+                     language=WHISPER_LANGUAGE, offset_seconds=0.0):
+    """VAD 切段後轉錄 16kHz float32 音訊，回傳 (逐字稿, [{"start", "end", "text"}, ...], 統計)。
+
+    統計中的 cpu_seconds 為各片段在執行它的行程內實際耗用的 CPU 時間加總。
+
+    processes <= 1 時以傳入的 model 在本行程依序轉錄；否則交給行程池平行轉錄。
+    offset_seconds 會加到所有時間戳上（audio 為整段錄音中的一部分時使用）。
+    """
+    regions = detect_speech_regions(audio)
+    segments = group_regions(regions)
+    speech_samples = sum(end - start for start, end in segments)
+    stats = {
+        "audio_seconds": len(audio) / SAMPLE_RATE,
+        "speech_seconds": speech_samples / SAMPLE_RATE,
+        "segments": len(segments),
+        "cpu_seconds": 0.0,
+    }
+    if not segments:
+        return "", [], stats
+
+    jobs = [(audio[start:end], offset_seconds + start / SAMPLE_RATE) for start, end in segments]
+    if processes <= 1:
+        results = [_transcribe_samples(model, samples, offset, language) for samples, offset in jobs]
+    else:
+        pool = pool or get_asr_pool(model_size, processes)
+        futures = [pool.submit(_transcribe_in_worker, samples, offset, language) for samples, offset in jobs]
+        results = [f.result() for f in futures]
+
+    texts = [text for text, _, _ in results if text]
+    timeline = [seg for _, segs, _ in results for seg in segs]
+    stats["cpu_seconds"] = sum(cpu for _, _, cpu in results)
+    return "\n".join(texts), timeline, stats
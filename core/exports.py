@@ -0,0 +1,195 @@
+# core/exports.py
+# 成績匯出：逐列產生並串流輸出 CSV / XLSX，資料以 keyset 分批讀取，匯出筆數再多記憶體用量也固定
+import csv
+import re
+import zipfile
+from itertools import groupby
+from xml.sax.saxutils import escape
+
+from django.utils import timezone
+
+from .models import Lecture, LectureScore, Submission
+from .pagination import iterate_keyset
+
+EXPORT_BATCH_SIZE = 2000
+XLSX_FLUSH_ROWS = 500
+
+QUESTION_HEADER = ['學生帳號', '學生姓名', '課程', '單元編號', '單元標題', '題目編號', '題型', '知識概念',
+                   '學生作答', '正確答案', '是否正確', '作答時間']
+
+
+def question_rows(course_id=None, lecture_id=None):
+    """每筆作答一列：第一列為標題。"""
+    submissions = Submission.objects.select_related('student__user', 'question__lecture__course').only(
+        'id', 'student_answer', 'is_correct', 'submitted_at',
+        'student__name', 'student__user__username',
+        'question__id', 'question__question_type', 'question__concept', 'question__correct_answer',
+        'question__lecture__id', 'question__lecture__title', 'question__lecture__course__name',
+    )
+    if course_id:
+        submissions = submissions.filter(question__lecture__course_id=course_id)
+    if lecture_id:
+        submissions = submissions.filter(question__lecture_id=lecture_id)
+
+    yield QUESTION_HEADER
+    for sub in iterate_keyset(submissions, ('id',), EXPORT_BATCH_SIZE):
+        student, question = sub.student, sub.question
+        lecture = question.lecture
+        yield [
+            student.user.username if student.user else '',
+            student.name,
+            lecture.course.name,
+            lecture.id,
+            lecture.title or '',
+            question.id,
+            question.get_question_type_display(),
+            question.concept,
+            sub.student_answer,
+            question.correct_answer,
+            1 if sub.is_correct else 0,
+            timezone.localtime(sub.submitted_at).strftime('%Y-%m-%d %H:%M:%S'),
+        ]
+
+
+def matrix_rows(course_id=None, lecture_id=None):
+    """學生 × 講次正確率矩陣：每位學生一列，未作答的講次留空，最後三欄為總計。"""
+    lectures = Lecture.objects.only('id', 'title').order_by('date', 'id')
+    if course_id:
+        lectures = lectures.filter(course_id=course_id)
+    if lecture_id:
+        lectures = lectures.filter(id=lecture_id)
+    columns = {}
+    header = ['學生帳號', '學生姓名']
+    for lecture in lectures:
+        columns[lecture.id] = len(columns)
+        header.append(f'#{lecture.id} {lecture.title or ""}'.strip())
+    yield header + ['作答題數', '答對題數', '正確率(%)']
+
+    scores = LectureScore.objects.select_related('student__user').only(
+        'id', 'lecture_id', 'total', 'correct', 'student__name', 'student__user__username',
+    )
+    if course_id:
+        scores = scores.filter(lecture__course_id=course_id)
+    if lecture_id:
+        scores = scores.filter(lecture_id=lecture_id)
+    # 依學生排序分批讀取，同一位學生的講次成績相鄰，逐位組成一列即可輸出
+    rows = iterate_keyset(scores, ('student_id', 'id'), EXPORT_BATCH_SIZE)
+    for _, student_scores in groupby(rows, key=lambda s: s.student_id):
+        cells = [''] * len(columns)
+        total = correct = 0
+        student = None
+        for score in student_scores:
+            student = score.student
+            cells[columns[score.lecture_id]] = score.accuracy
+            total += score.total
+            correct += score.correct
+        yield [
+            student.user.username if student.user else '',
+            student.name,
+            *cells,
+            total,
+            correct,
+            round(correct / total * 100, 2) if total else 0,
+        ]
+
+
+# ---------- CSV ----------
+
+class _Echo:
+    # csv.writer 只需要 write()，直接回傳字串讓產生器逐列輸出
+    def write(self, value):
+        return value
+
+
+def stream_csv(rows):
+    writer = csv.writer(_Echo())
+    yield '\ufeff'  # 讓 Excel 以 UTF-8 開啟中文
+    for row in rows:
+        yield writer.writerow(row)
+
+
+# ---------- XLSX ----------
+# 以 zipfile 寫入不可 seek 的緩衝區，邊產生工作表 XML 邊輸出壓縮後的位元組
+
+_XLSX_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="{sheet_name}" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+_ILLEGAL_XML_RE = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+class _ChunkBuffer:
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _xlsx_cell(value):
+    if isinstance(value, bool):
+        value = int(value)
+    if isinstance(value, (int, float)):
+        return f'<c><v>{value}</v></c>'
+    text = escape(_ILLEGAL_XML_RE.sub('', str(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def stream_xlsx(rows, sheet_name='成績'):
+    buffer = _ChunkBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as workbook:
+        for name, content in _XLSX_PARTS.items():
+            workbook.writestr(name, content.replace('{sheet_name}', escape(sheet_name)))
+        with workbook.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            )
+            for count, row in enumerate(rows, 1):
+                sheet.write(('<row>' + ''.join(_xlsx_cell(v) for v in row) + '</row>').encode('utf-8'))
+                if count % XLSX_FLUSH_ROWS == 0:
+                    yield buffer.pop()
+            sheet.write(b'</sheetData></worksheet>')
+    yield buffer.pop()
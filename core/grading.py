@@ -0,0 +1,246 @@
+# core/grading.py
+# 測驗批改：一次取出答案、一次寫入所有作答，重複送出由 (student, question) 唯一限制擋下
+# 同一個交易內累加 LectureScore / ConceptScore，報表頁只需讀統計表
+import os
+import uuid
+
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, FilteredRelation, Max, Q
+from django.utils import timezone
+
+from .models import ConceptScore, LectureScore, Question, Submission
+
+ROLLUP_BATCH_SIZE = 500
+LECTURE_REPORT_CACHE_SECONDS = int(os.getenv('LECTURE_REPORT_CACHE_SECONDS', '60'))
+SUBMISSION_RESULT_CACHE_SECONDS = int(os.getenv('SUBMISSION_RESULT_CACHE_SECONDS', str(7 * 24 * 3600)))
+
+
+def build_results(questions, submissions):
+    """依題目順序組成 submission_result.html 使用的結果列，並計算分數。"""
+    by_question = {sub.question_id: sub for sub in submissions}
+    results = []
+    correct = 0
+    for q in questions:
+        sub = by_question.get(q.id)
+        if sub is not None and sub.is_correct:
+            correct += 1
+        results.append({
+            'question': q,
+            'student_answer': sub.student_answer if sub else None,
+            'is_correct': sub.is_correct if sub else None,
+        })
+    total = len(results)
+    score = {
+        'total': total,
+        'correct': correct,
+        'wrong': total - correct,
+        'accuracy': round(correct / total * 100, 2) if total else 0,
+    }
+    return results, score
+
+
+def student_results(student, lecture):
+    """以一次 LEFT JOIN 取出講次題目與學生的作答，回傳與 grade_quiz 相同的 (results, score)。"""
+    questions = list(
+        Question.objects.filter(lecture=lecture)
+        .annotate(own=FilteredRelation('submission', condition=Q(submission__student=student)))
+        .annotate(sub_id=F('own__id'), sub_answer=F('own__student_answer'), sub_correct=F('own__is_correct'))
+        .order_by('id')
+    )
+    submissions = [
+        Submission(id=q.sub_id, question_id=q.id, student_answer=q.sub_answer, is_correct=q.sub_correct)
+        for q in questions if q.sub_id is not None
+    ]
+    return build_results(questions, submissions)
+
+
+def _questions_version(lecture_id):
+    # 講次題目的版本標記；題目新增、修改或刪除時清除，舊版本的快取自然失效
+    key = f'lecture_questions_version:{lecture_id}'
+    version = cache.get(key)
+    if version is None:
+        version = uuid.uuid4().hex[:12]
+        if not cache.add(key, version, None):
+            version = cache.get(key) or version
+    return version
+
+
+def invalidate_lecture_results(lecture_id):
+    cache.delete(f'lecture_questions_version:{lecture_id}')
+
+
+def result_cache_key(student_id, lecture_id):
+    return f'submission_result:{lecture_id}:{_questions_version(lecture_id)}:{student_id}'
+
+
+def grade_quiz(student, lecture, answers):
+    """批改一份測驗並寫入作答；回傳 (results, score)，已作答過則回傳 None。
+
+    answers 為 {str(question_id): 答案} 的對應（例如 request.POST）。
+    """
+    questions = list(Question.objects.filter(lecture=lecture).order_by('id'))
+    submissions = []
+    for q in questions:
+        student_answer = answers.get(str(q.id)) or ''
+        submissions.append(Submission(
+            student=student,
+            question=q,
+            student_answer=student_answer,
+            is_correct=student_answer == q.correct_answer,
+        ))
+
+    try:
+        with transaction.atomic():
+            Submission.objects.bulk_create(submissions)
+            update_rollups(student, submissions)
+            transaction.on_commit(lambda: invalidate_lecture_report(lecture.id))
+    except IntegrityError:
+        # 同一份測驗重複送出（或兩個分頁同時送出），整批不寫入
+        return None
+    return build_results(questions, submissions)
+
+
+def _increment(model, lookup, total, correct, **fields):
+    changes = dict(total=F('total') + total, correct=F('correct') + correct, **fields)
+    if model.objects.filter(**lookup).update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(total=total, correct=correct, **lookup, **fields)
+    except IntegrityError:
+        # 另一個交易剛好先建立了同一列，改為累加
+        model.objects.filter(**lookup).update(**changes)
+
+
+def update_rollups(student, submissions):
+    """把新寫入的作答累加到統計表；需在寫入 Submission 的同一個交易內呼叫。"""
+    per_lecture = {}
+    per_concept = {}
+    for sub in submissions:
+        for counts, key in ((per_lecture, sub.question.lecture_id), (per_concept, sub.question.concept)):
+            total, correct = counts.get(key, (0, 0))
+            counts[key] = (total + 1, correct + int(sub.is_correct))
+    last_submitted_at = max((sub.submitted_at for sub in submissions if sub.submitted_at), default=timezone.now())
+
+    # 依鍵排序後再更新，多個交易同時累加時鎖定順序一致
+    for lecture_id, (total, correct) in sorted(per_lecture.items()):
+        _increment(LectureScore, {'student': student, 'lecture_id': lecture_id}, total, correct,
+                   last_submitted_at=last_submitted_at)
+    for concept, (total, correct) in sorted(per_concept.items()):
+        _increment(ConceptScore, {'student': student, 'concept': concept}, total, correct)
+
+
+def rebuild_rollups(student_ids=None):
+    """由 Submission 重新計算統計表；student_ids 為 None 時重建全部。回傳 (講次列數, 概念列數)。"""
+    submissions = Submission.objects.all()
+    lecture_scores = LectureScore.objects.all()
+    concept_scores = ConceptScore.objects.all()
+    if student_ids is not None:
+        student_ids = list(student_ids)
+        submissions = submissions.filter(student_id__in=student_ids)
+        lecture_scores = lecture_scores.filter(student_id__in=student_ids)
+        concept_scores = concept_scores.filter(student_id__in=student_ids)
+
+    counts = dict(total=Count('id'), correct=Count('id', filter=Q(is_correct=True)))
+    with transaction.atomic():
+        lecture_scores.delete()
+        concept_scores.delete()
+        lecture_rows = [
+            LectureScore(student_id=row['student_id'], lecture_id=row['question__lecture_id'],
+                         total=row['total'], correct=row['correct'], last_submitted_at=row['last_submitted_at'])
+            for row in submissions.values('student_id', 'question__lecture_id')
+            .annotate(last_submitted_at=Max('submitted_at'), **counts).order_by()
+        ]
+        concept_rows = [
+            ConceptScore(student_id=row['student_id'], concept=row['question__concept'],
+                         total=row['total'], correct=row['correct'])
+            for row in submissions.values('student_id', 'question__concept').annotate(**counts).order_by()
+        ]
+        LectureScore.objects.bulk_create(lecture_rows, batch_size=ROLLUP_BATCH_SIZE)
+        ConceptScore.objects.bulk_create(concept_rows, batch_size=ROLLUP_BATCH_SIZE)
+    return len(lecture_rows), len(concept_rows)
+
+
+def affected_student_ids(lectures):
+    """刪除講次（連帶刪除題目與作答）前，先找出統計需要重建的學生。"""
+    return list(
+        LectureScore.objects.filter(lecture__in=lectures).values_list('student_id', flat=True).distinct()
+    )
+
+
+def lecture_report(lecture):
+    """講次作答統計：回傳 (各學生 LectureScore, 附 answered_count/correct_count/correct_rate 的題目)。
+
+    查詢次數固定為兩次，不隨學生人數增加。
+    """
+    scores = list(
+        LectureScore.objects.filter(lecture=lecture)
+        .select_related('student__user')
+        .order_by('student_id')
+    )
+    questions = list(
+        Question.objects.filter(lecture=lecture)
+        .annotate(
+            answered_count=Count('submission'),
+            correct_count=Count('submission', filter=Q(submission__is_correct=True)),
+        )
+        .order_by('id')
+    )
+    for q in questions:
+        q.correct_rate = round(q.correct_count / q.answered_count * 100, 2) if q.answered_count else None
+    return scores, questions
+
+
+def _lecture_report_key(lecture_id):
+    return f'lecture_report:{lecture_id}'
+
+
+def invalidate_lecture_report(lecture_id):
+    cache.delete(_lecture_report_key(lecture_id))
+
+
+def lecture_report_data(lecture):
+    """lecture_report 的 JSON 版本，快取 LECTURE_REPORT_CACHE_SECONDS 秒，批改或重新出題時清除。"""
+    key = _lecture_report_key(lecture.id)
+    data = cache.get(key)
+    if data is not None:
+        return data
+
+    scores, questions = lecture_report(lecture)
+    total = sum(s.total for s in scores)
+    correct = sum(s.correct for s in scores)
+    data = {
+        'lecture_id': lecture.id,
+        'students': [
+            {
+                'student_id': s.student_id,
+                'username': s.student.user.username if s.student.user else s.student.name,
+                'total': s.total,
+                'correct': s.correct,
+                'accuracy': s.accuracy,
+                'last_submitted_at': s.last_submitted_at.isoformat(),
+            }
+            for s in scores
+        ],
+        'questions': [
+            {
+                'question_id': q.id,
+                'question_text': q.question_text,
+                'question_type': q.question_type,
+                'concept': q.concept,
+                'answered': q.answered_count,
+                'correct': q.correct_count,
+                'correct_rate': q.correct_rate,
+            }
+            for q in questions
+        ],
+        'summary': {
+            'students': len(scores),
+            'submissions': total,
+            'correct': correct,
+            'accuracy': round(correct / total * 100, 2) if total else 0,
+        },
+    }
+    cache.set(key, data, LECTURE_REPORT_CACHE_SECONDS)
+    return data
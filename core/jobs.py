@@ -0,0 +1,158 @@
+# core/jobs.py
+# 以資料庫為佇列的講次背景處理（不需額外的 broker）
+import os
+import socket
+import threading
+import traceback
+from datetime import timedelta
+
+from django.db import DatabaseError, close_old_connections, connection
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Lecture, LectureJob
+
+DEFAULT_VISIBILITY_TIMEOUT = int(os.getenv('LECTURE_JOB_VISIBILITY_TIMEOUT', '300'))
+RETRY_DELAY_SECONDS = int(os.getenv('LECTURE_JOB_RETRY_DELAY', '30'))
+
+
+def enqueue_lecture_processing(lecture, num_mcq=3, num_tf=0, regenerate_questions=False):
+    Lecture.objects.filter(pk=lecture.pk).update(status='queued')
+    lecture.status = 'queued'
+    return LectureJob.objects.create(lecture=lecture, num_mcq=num_mcq, num_tf=num_tf,
+                                     regenerate_questions=regenerate_questions)
+
+
+def enqueue_live_transcription(lecture):
+    # 錄音期間每收到一段就可能呼叫；已有等待中的即時轉錄工作時不重複排入
+    if LectureJob.objects.filter(lecture=lecture, kind='live', status='pending').exists():
+        return None
+    return LectureJob.objects.create(lecture=lecture, kind='live', num_mcq=0, max_attempts=1)
+
+
+def make_worker_id(index=0):
+    return f"{socket.gethostname()}:{os.getpid()}:{index}"
+
+
+def _claimable(now):
+    # 等待中且到了執行時間，或是執行中但租約已過期（worker 當掉）
+    return Q(status='pending', run_after__lte=now) | Q(status='running', locked_until__lt=now)
+
+
+def fail_exhausted_jobs():
+    now = timezone.now()
+    exhausted = LectureJob.objects.filter(
+        status='running', locked_until__lt=now, attempts__gte=F('max_attempts')
+    )
+    # 即時轉錄工作失敗不影響講次狀態
+    lecture_ids = list(exhausted.filter(kind='process').values_list('lecture_id', flat=True))
+    exhausted.update(status='failed', locked_by='', locked_until=None,
+                     last_error='worker 租約逾時且已達重試上限')
+    if lecture_ids:
+        Lecture.objects.filter(id__in=lecture_ids).update(status='failed')
+
+
+def claim_next_job(worker_id, visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT):
+    fail_exhausted_jobs()
+    now = timezone.now()
+    candidates = (
+        LectureJob.objects.filter(_claimable(now), attempts__lt=F('max_attempts'))
+        .order_by('run_after', 'id')
+        .values_list('id', flat=True)[:10]
+    )
+    for job_id in candidates:
+        # 以條件式 UPDATE 搶工作：只有一個 worker 能讓這筆資料從可領取變成自己的
+        claimed = LectureJob.objects.filter(_claimable(now), id=job_id).update(
+            status='running',
+            locked_by=worker_id,
+            locked_until=now + timedelta(seconds=visibility_timeout),
+            attempts=F('attempts') + 1,
+            updated_at=now,
+        )
+        if claimed:
+            return LectureJob.objects.get(id=job_id)
+    return None
+
+
+class JobHeartbeat(threading.Thread):
+    """在工作執行期間定期延長租約，避免長時間的轉錄被其他 worker 重複領取。"""
+
+    def __init__(self, job_id, worker_id, visibility_timeout):
+        super().__init__(daemon=True)
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.visibility_timeout = visibility_timeout
+        self._stopped = threading.Event()
+
+    def run(self):
+        interval = max(1, self.visibility_timeout // 3)
+        try:
+            while not self._stopped.wait(interval):
+                try:
+                    LectureJob.objects.filter(id=self.job_id, locked_by=self.worker_id).update(
+                        locked_until=timezone.now() + timedelta(seconds=self.visibility_timeout)
+                    )
+                except DatabaseError as e:
+                    # 例如 SQLite 寫入鎖逾時：下一輪再續約，租約還有 2/3 的時間，不能讓執行緒就此結束
+                    print(f"⚠️ 工作 #{self.job_id} 續約失敗：{e}")
+        finally:
+            connection.close()
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+def run_job(job, worker_id, visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT):
+    from .ai_modules import process_audio_and_generate_quiz, transcribe_live_recording
+
+    print(f"🚚 開始處理工作 #{job.id}（講次 {job.lecture_id}，{job.get_kind_display()}，第 {job.attempts} 次）")
+    heartbeat = JobHeartbeat(job.id, worker_id, visibility_timeout)
+    heartbeat.start()
+    try:
+        if job.kind == 'live':
+            transcribe_live_recording(job.lecture_id)
+        else:
+            process_audio_and_generate_quiz(job.lecture_id, num_mcq=job.num_mcq, num_tf=job.num_tf,
+                                            regenerate_questions=job.regenerate_questions)
+    except Exception as e:
+        heartbeat.stop()
+        error = traceback.format_exc()
+        owned = LectureJob.objects.filter(id=job.id, locked_by=worker_id)
+        if job.kind == 'live':
+            # 即時轉錄失敗不影響講次，下一段錄音或停止錄音後的完整處理會補上
+            print(f"⚠️ 即時轉錄工作 #{job.id} 失敗：{e}")
+            owned.update(status='failed', locked_by='', locked_until=None, last_error=error)
+        elif job.attempts >= job.max_attempts:
+            print(f"❌ 工作 #{job.id} 失敗（已達重試上限）：{e}")
+            owned.update(status='failed', locked_by='', locked_until=None, last_error=error)
+            Lecture.objects.filter(id=job.lecture_id).update(status='failed')
+        else:
+            delay = RETRY_DELAY_SECONDS * 2 ** (job.attempts - 1)
+            print(f"⚠️ 工作 #{job.id} 失敗，{delay} 秒後重試：{e}")
+            owned.update(status='pending', locked_by='', locked_until=None, last_error=error,
+                         run_after=timezone.now() + timedelta(seconds=delay))
+            Lecture.objects.filter(id=job.lecture_id).update(status='queued')
+        return False
+    heartbeat.stop()
+    LectureJob.objects.filter(id=job.id, locked_by=worker_id).update(
+        status='done', locked_by='', locked_until=None
+    )
+    print(f"✅ 工作 #{job.id} 完成")
+    return True
+
+
+def work_loop(worker_id, stop_event, visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT,
+              poll_interval=5, once=False):
+    try:
+        while not stop_event.is_set():
+            close_old_connections()
+            job = claim_next_job(worker_id, visibility_timeout)
+            if job is None:
+                if once:
+                    break
+                stop_event.wait(poll_interval)
+                continue
+            run_job(job, worker_id, visibility_timeout)
+    finally:
+        connection.close()
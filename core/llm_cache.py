@@ -0,0 +1,227 @@
+# core/llm_cache.py
+# 以 prompt 內容雜湊為鍵的 OpenAI 回應快取（存於資料庫，依容量與存放時間淘汰）
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import timedelta
+
+from django.db import IntegrityError
+from django.db.models import F, Sum
+from django.utils import timezone
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+from .models import LLMCacheEntry
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+LLM_CACHE_MAX_AGE_DAYS = int(os.getenv("LLM_CACHE_MAX_AGE_DAYS", "30"))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(50 * 1024 * 1024)))
+PRUNE_EVERY_WRITES = 50
+
+# 不影響回應內容的參數不納入快取鍵
+_NON_SEMANTIC_PARAMS = {"stream", "stream_options", "timeout", "extra_headers", "extra_query", "extra_body", "user"}
+
+_stats_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "bypassed": 0, "saved_seconds": 0.0, "saved_tokens": 0}
+_writes_since_prune = 0
+
+
+def cache_key(params):
+    payload = {k: v for k, v in params.items() if k not in _NON_SEMANTIC_PARAMS}
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _bump(**deltas):
+    with _stats_lock:
+        for name, value in deltas.items():
+            _stats[name] += value
+
+
+def stats():
+    with _stats_lock:
+        snapshot = dict(_stats)
+    lookups = snapshot["hits"] + snapshot["misses"]
+    snapshot["hit_ratio"] = snapshot["hits"] / lookups if lookups else 0.0
+    return snapshot
+
+
+def prune(max_age_days=LLM_CACHE_MAX_AGE_DAYS, max_bytes=LLM_CACHE_MAX_BYTES):
+    """刪除過期項目，再依最近使用時間淘汰直到總容量低於上限；回傳刪除筆數。"""
+    deleted, _ = LLMCacheEntry.objects.filter(
+        created_at__lt=timezone.now() - timedelta(days=max_age_days)
+    ).delete()
+
+    total = LLMCacheEntry.objects.aggregate(total=Sum("size_bytes"))["total"] or 0
+    if total > max_bytes:
+        evict_ids = []
+        for entry_id, size in LLMCacheEntry.objects.order_by("last_hit_at").values_list("id", "size_bytes").iterator():
+            if total <= max_bytes:
+                break
+            evict_ids.append(entry_id)
+            total -= size
+        for start in range(0, len(evict_ids), 500):
+            deleted += LLMCacheEntry.objects.filter(id__in=evict_ids[start:start + 500]).delete()[0]
+    return deleted
+
+
+def _lookup(key):
+    entry = LLMCacheEntry.objects.filter(key=key).only(
+        "id", "response_json", "latency_seconds", "total_tokens"
+    ).first()
+    if entry is None:
+        return None
+    LLMCacheEntry.objects.filter(id=entry.id).update(
+        hit_count=F("hit_count") + 1, last_hit_at=timezone.now()
+    )
+    _bump(hits=1, saved_seconds=entry.latency_seconds, saved_tokens=entry.total_tokens)
+    return ChatCompletion.model_validate_json(entry.response_json)
+
+
+def invalidate(params):
+    """刪除 params 對應的快取項目；呼叫端解析回應失敗時使用，重試時會重新送出請求。"""
+    return LLMCacheEntry.objects.filter(key=cache_key(params)).delete()[0]
+
+
+def _cacheable(response):
+    # 只存完整結束的回應；被 max_tokens 截斷（finish_reason='length'）的內容每次重播都會解析失敗
+    choices = getattr(response, "choices", None)
+    return bool(choices) and all(choice.finish_reason == "stop" for choice in choices)
+
+
+def _store(key, params, response, latency):
+    global _writes_since_prune
+    if not _cacheable(response):
+        return
+    body = response.model_dump_json()
+    usage = getattr(response, "usage", None)
+    defaults = {
+        "model": params.get("model", ""),
+        "response_json": body,
+        "size_bytes": len(body.encode("utf-8")),
+        "latency_seconds": latency,
+        "total_tokens": getattr(usage, "total_tokens", 0) or 0,
+        "last_hit_at": timezone.now(),
+    }
+    try:
+        LLMCacheEntry.objects.update_or_create(key=key, defaults=defaults)
+    except IntegrityError:
+        # 另一個執行緒同時寫入同一個鍵，保留先寫入的結果即可
+        return
+    with _stats_lock:
+        _writes_since_prune += 1
+        should_prune = _writes_since_prune >= PRUNE_EVERY_WRITES
+        if should_prune:
+            _writes_since_prune = 0
+    if should_prune:
+        prune()
+
+
+class CachedCompletions:
+    def __init__(self, completions):
+        self._completions = completions
+
+    def create(self, bypass_cache=False, **params):
+        # 串流請求與一般請求共用快取鍵：串流結束後組回完整回應存入，命中時以單一 chunk 重播
+        if not LLM_CACHE_ENABLED:
+            return self._completions.create(**params)
+        streaming = bool(params.get("stream"))
+
+        key = cache_key(params)
+        if bypass_cache:
+            _bump(bypassed=1)
+        else:
+            try:
+                cached = _lookup(key)
+            except Exception as e:
+                print(f"⚠️ LLM 快取讀取失敗：{e}")
+                cached = None
+            if cached is not None:
+                return _replay_stream(cached) if streaming else cached
+            _bump(misses=1)
+
+        started = time.perf_counter()
+        response = self._completions.create(**params)
+        if streaming:
+            return self._record_stream(response, key, params, started)
+        latency = time.perf_counter() - started
+        try:
+            _store(key, params, response, latency)
+        except Exception as e:
+            print(f"⚠️ LLM 快取寫入失敗：{e}")
+        return response
+
+    def invalidate(self, **params):
+        # 參數與 create 相同（不含 bypass_cache）
+        if not LLM_CACHE_ENABLED:
+            return
+        try:
+            invalidate(params)
+        except Exception as e:
+            print(f"⚠️ LLM 快取刪除失敗：{e}")
+
+    def _record_stream(self, stream, key, params, started):
+        # 邊轉發邊收集內容；串流完整讀完才寫入快取，中途失敗或未讀完的回應不會存
+        parts, finish_reason, usage, first = [], None, None, None
+        for chunk in stream:
+            first = first or chunk
+            if chunk.choices:
+                choice = chunk.choices[0]
+                if choice.delta.content:
+                    parts.append(choice.delta.content)
+                finish_reason = choice.finish_reason or finish_reason
+            if getattr(chunk, "usage", None):
+                usage = chunk.usage
+            yield chunk
+        if first is None or finish_reason != "stop":
+            return
+        latency = time.perf_counter() - started
+        try:
+            response = ChatCompletion.model_validate({
+                "id": first.id,
+                "object": "chat.completion",
+                "created": first.created,
+                "model": first.model,
+                "choices": [{
+                    "index": 0,
+                    "finish_reason": finish_reason,
+                    "message": {"role": "assistant", "content": "".join(parts)},
+                }],
+                "usage": usage.model_dump() if usage is not None else None,
+            })
+            _store(key, params, response, latency)
+        except Exception as e:
+            print(f"⚠️ LLM 快取寫入失敗：{e}")
+
+
+def _replay_stream(completion):
+    # 快取命中的串流請求：整份回應以單一 chunk 送出，呼叫端照常逐 chunk 解析
+    choice = completion.choices[0]
+    yield ChatCompletionChunk.model_validate({
+        "id": completion.id,
+        "object": "chat.completion.chunk",
+        "created": completion.created,
+        "model": completion.model,
+        "choices": [{
+            "index": 0,
+            "delta": {"role": "assistant", "content": choice.message.content},
+            "finish_reason": choice.finish_reason,
+        }],
+    })
+
+
+class _CachedChat:
+    def __init__(self, chat):
+        self.completions = CachedCompletions(chat.completions)
+
+
+class CachedOpenAIClient:
+    """包住 OpenAI client；chat.completions.create 額外接受 bypass_cache=True 以強制重新產生。"""
+
+    def __init__(self, client):
+        self._client = client
+        self.chat = _CachedChat(client.chat)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from core.ai_modules import decode_audio, hash_file, pcm_fingerprint
+from core.models import Lecture
+
+
+class Command(BaseCommand):
+    help = '為既有講次補算音檔雜湊（檔案 sha256 與解碼後 PCM sha256）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--skip-pcm', action='store_true', help='只計算檔案雜湊，不做 ffmpeg 解碼')
+
+    def handle(self, *args, **options):
+        missing = Q(audio_sha256='')
+        if not options['skip_pcm']:
+            missing |= Q(pcm_sha256='')
+        lectures = Lecture.objects.filter(missing).exclude(audio_file='').only(
+            'id', 'audio_file', 'audio_sha256', 'pcm_sha256'
+        )
+
+        updated = failed = 0
+        for lecture in lectures.iterator():
+            try:
+                path = lecture.audio_file.path
+                if not lecture.audio_sha256:
+                    lecture.audio_sha256 = hash_file(path)
+                if not lecture.pcm_sha256 and not options['skip_pcm']:
+                    lecture.pcm_sha256 = pcm_fingerprint(decode_audio(path))
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f"❌ 講次 {lecture.id} 計算失敗：{e}")
+                continue
+            lecture.save(update_fields=['audio_sha256', 'pcm_sha256'])
+            updated += 1
+
+        self.stdout.write(self.style.SUCCESS(f"✅ 已更新 {updated} 筆講次，失敗 {failed} 筆"))
@@ -0,0 +1,53 @@
+import os
+import time
+
+import whisper
+from django.core.management.base import BaseCommand
+
+from core import asr
+
+
+class Command(BaseCommand):
+    help = '比較整檔轉錄與 VAD 分段平行轉錄的速度（RTF 與 CPU 使用率）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--audio', default='lectures/TEST2.mp3')
+        parser.add_argument('--model', default='small')
+        parser.add_argument('--processes', type=int, default=max(1, (os.cpu_count() or 1) // 2))
+
+    def _report(self, label, wall, cpu, audio_seconds, cores):
+        self.stdout.write(
+            f"{label:<12} 耗時 {wall:7.1f}s  RTF {wall / audio_seconds:5.3f}  "
+            f"CPU 使用率 {cpu / (wall * cores) * 100:5.1f}%（{cores} 核）"
+        )
+
+    def handle(self, *args, **options):
+        cores = os.cpu_count() or 1
+        audio = whisper.load_audio(options['audio'])
+        audio_seconds = len(audio) / asr.SAMPLE_RATE
+        self.stdout.write(f"🎧 {options['audio']}：{audio_seconds:.1f}s，模型 {options['model']}")
+
+        # 模型載入時間不計入，只比較推論
+        model = whisper.load_model(options['model'])
+        cpu, started = time.process_time(), time.perf_counter()
+        model.transcribe(audio, fp16=False)
+        self._report('整檔轉錄', time.perf_counter() - started, time.process_time() - cpu, audio_seconds, cores)
+
+        processes = options['processes']
+        if processes <= 1:
+            started = time.perf_counter()
+            _, _, stats = asr.transcribe_audio(audio, options['model'], processes=1, model=model)
+            wall = time.perf_counter() - started
+        else:
+            del model
+            pool = asr.create_asr_pool(options['model'], processes)
+            # 先讓每個子行程載入模型，之後才開始計時
+            list(pool.map(time.sleep, [0.5] * processes))
+            started = time.perf_counter()
+            _, _, stats = asr.transcribe_audio(audio, options['model'], processes=processes, pool=pool)
+            wall = time.perf_counter() - started
+            pool.shutdown(wait=True)
+        self._report(f'VAD×{processes}', wall, stats['cpu_seconds'], audio_seconds, cores)
+        self.stdout.write(
+            f"語音 {stats['speech_seconds']:.1f}s / 全長 {stats['audio_seconds']:.1f}s，共 {stats['segments']} 段"
+        )
@@ -0,0 +1,49 @@
+import os
+import subprocess
+import tempfile
+import time
+
+import whisper
+from django.core.management.base import BaseCommand
+
+from core import asr
+
+
+class Command(BaseCommand):
+    help = '比較舊流程（錄音轉 WAV 暫存檔再解碼）與直接解碼到記憶體的耗時與磁碟用量'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--audio', default='lectures/TEST2.mp3')
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def _time(self, fn, repeat):
+        best = float('inf')
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = fn()
+            best = min(best, time.perf_counter() - started)
+        return best, result
+
+    def handle(self, *args, **options):
+        path, repeat = options['audio'], options['repeat']
+        stored_bytes = os.path.getsize(path)
+
+        fd, wav_path = tempfile.mkstemp(suffix='.wav')
+        os.close(fd)
+        try:
+            def legacy():
+                # 舊流程：請求中以 ffmpeg（pydub）轉成原取樣率 16-bit WAV 存檔，轉錄時再解碼一次
+                subprocess.run(['ffmpeg', '-nostdin', '-y', '-loglevel', 'error', '-i', path,
+                                '-acodec', 'pcm_s16le', wav_path], check=True)
+                return whisper.load_audio(wav_path)
+
+            legacy_s, _ = self._time(legacy, repeat)
+            wav_bytes = os.path.getsize(wav_path)
+        finally:
+            os.remove(wav_path)
+
+        direct_s, audio = self._time(lambda: whisper.load_audio(path), repeat)
+        self.stdout.write(f"🎧 {path}：{len(audio) / asr.SAMPLE_RATE:.1f}s")
+        self.stdout.write(f"舊流程  {legacy_s:6.2f}s  存檔 {wav_bytes / 1e6:7.1f} MB（WAV）")
+        self.stdout.write(f"直接解碼 {direct_s:6.2f}s  存檔 {stored_bytes / 1e6:7.1f} MB（原始壓縮格式）")
+        self.stdout.write(f"每份錄音省下 {legacy_s - direct_s:.2f}s、{(wav_bytes - stored_bytes) / 1e6:.1f} MB")
@@ -0,0 +1,113 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from core import search
+from core.models import Course, Lecture
+
+_CHARS = '的一是不了人我在有他這中大來上國個到說們為子和你地出道也時年得就那要下以生會自之著去學習課程老師同學今天'
+_WORDS = ['機器學習', '資料庫', '演算法', '期中考', '作業系統', '網路安全', '線性代數', '微積分', 'Python', 'Django']
+
+
+def make_text(rng, size):
+    parts, total = [], 0
+    while total < size:
+        sentence = ''.join(rng.choice(_CHARS) for _ in range(rng.randint(5, 60))) + rng.choice('。！？')
+        parts.append(sentence)
+        total += len(sentence)
+    return ''.join(parts)
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = '以合成講次比較 icontains 掃描與全文檢索索引的查詢速度（資料於結束時回滾或刪除）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lectures', type=int, default=10000)
+        parser.add_argument('--transcript-chars', type=int, default=3000)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--query', action='append', dest='queries',
+                            help='要測試的關鍵字（可重複指定），預設使用內建詞彙')
+
+    def _time(self, fn, repeat):
+        best = float('inf')
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = fn()
+            best = min(best, time.perf_counter() - started)
+        return best, result
+
+    def _populate(self, course, count, transcript_chars):
+        rng = random.Random(0)
+        lectures = []
+        for i in range(count):
+            words = rng.sample(_WORDS, 2)
+            transcript = make_text(rng, transcript_chars)
+            cut = rng.randrange(len(transcript))
+            lectures.append(Lecture(
+                course=course,
+                title=f'{words[0]} 第 {i} 講',
+                summary=f'本講介紹{words[0]}與{words[1]}。' + transcript[:200],
+                transcript=transcript[:cut] + words[1] + transcript[cut:],
+                status='done',
+            ))
+        # bulk_create 不會觸發 post_save，索引需另外建立
+        started = time.perf_counter()
+        created = Lecture.objects.bulk_create(lectures, batch_size=500)
+        insert_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        for start in range(0, len(created), 500):
+            search.index_lectures(created[start:start + 500])
+        return insert_seconds, time.perf_counter() - started
+
+    def _run_queries(self, queries, repeat):
+        for query in queries:
+            terms = search.query_terms(query)
+            legacy = Lecture.objects.filter(summary__icontains=query).order_by('-id')
+            scan = Lecture.objects.all()
+            for term in terms:
+                scan = scan.filter(Q(title__icontains=term) | Q(summary__icontains=term)
+                                   | Q(transcript__icontains=term))
+            legacy_s, legacy_hits = self._time(lambda: list(legacy.values_list('id', flat=True)), repeat)
+            scan_s, scan_hits = self._time(lambda: list(scan.values_list('id', flat=True)), repeat)
+            index_s, index_hits = self._time(lambda: search.search_lecture_ids(query), repeat)
+            snippet_s, _ = self._time(lambda: search.search_snippets(query, index_hits[:5]), repeat)
+            self.stdout.write(
+                f"「{query}」 摘要 icontains {legacy_s * 1000:8.1f}ms（{len(legacy_hits)} 筆）  "
+                f"三欄位 icontains {scan_s * 1000:8.1f}ms（{len(scan_hits)} 筆）  "
+                f"索引 {index_s * 1000:7.1f}ms（前 {len(index_hits)} 筆）  "
+                f"片段 {snippet_s * 1000:6.1f}ms"
+            )
+
+    def handle(self, *args, **options):
+        queries = options['queries'] or ['機器學習', '資料庫 演算法', 'Django', '課程老師']
+        repeat = options['repeat']
+        self.stdout.write(f"🔍 搜尋後端：{search.backend()}，合成 {options['lectures']} 個講次")
+
+        if search.backend() == 'mysql':
+            # InnoDB 的 FULLTEXT 索引在 commit 時才更新，交易內查不到未提交的資料：
+            # 先提交測試資料再查詢，結束後刪除
+            course = Course.objects.create(name='搜尋效能測試')
+            try:
+                insert_seconds, index_seconds = self._populate(course, options['lectures'], options['transcript_chars'])
+                self.stdout.write(f"寫入 {insert_seconds:.1f}s，建立索引 {index_seconds:.1f}s")
+                self._run_queries(queries, repeat)
+            finally:
+                course.delete()
+            return
+
+        try:
+            with transaction.atomic():
+                course = Course.objects.create(name='搜尋效能測試')
+                insert_seconds, index_seconds = self._populate(course, options['lectures'], options['transcript_chars'])
+                self.stdout.write(f"寫入 {insert_seconds:.1f}s，建立索引 {index_seconds:.1f}s")
+                self._run_queries(queries, repeat)
+                raise _Rollback
+        except _Rollback:
+            pass
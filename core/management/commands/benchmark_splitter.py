@@ -0,0 +1,69 @@
+import random
+import re
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.ai_modules import count_tokens, split_transcript
+
+_CHARS = '的一是不了人我在有他這中大來上國個到說們為子和你地出道也時年得就那要下以生會自之著去學習課程老師同學今天'
+
+
+def legacy_dynamic_split(text, min_length=300, max_length=1000):
+    # 舊版以字串累加、字元數計長度的切段方式，僅供比較
+    text = text.strip()
+    if len(text) <= max_length:
+        return [text]
+    paragraphs = re.split(r'(?<=[。！？])\s*', text)
+    chunks, temp = [], ""
+    for para in paragraphs:
+        if len(temp) + len(para) <= max_length:
+            temp += para
+        else:
+            if len(temp) >= min_length:
+                chunks.append(temp.strip())
+                temp = para
+            else:
+                temp += para
+    if temp:
+        chunks.append(temp.strip())
+    return chunks
+
+
+def make_transcript(size, punctuated, seed=0):
+    rng = random.Random(seed)
+    parts, total = [], 0
+    while total < size:
+        sentence = ''.join(rng.choice(_CHARS) for _ in range(rng.randint(5, 60)))
+        sentence += rng.choice('。！？') if punctuated else rng.choice(['', ' '])
+        parts.append(sentence)
+        total += len(sentence)
+    return ''.join(parts)
+
+
+class Command(BaseCommand):
+    help = '以數 MB 的合成逐字稿比較舊版 dynamic_split 與 split_transcript 的速度與段落大小'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size-mb', type=float, default=4)
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def _run(self, label, fn, text, repeat):
+        best = float('inf')
+        for _ in range(repeat):
+            started = time.perf_counter()
+            chunks = fn(text)
+            best = min(best, time.perf_counter() - started)
+        tokens = [count_tokens(c) for c in chunks]
+        self.stdout.write(
+            f"  {label:<18} {best:7.3f}s  {len(text) / best / 1e6:6.2f} M 字/秒  "
+            f"{len(chunks):5d} 段  最大 {max(tokens):6d} tokens"
+        )
+
+    def handle(self, *args, **options):
+        size = int(options['size_mb'] * 1024 * 1024 / 3)  # 中文 UTF-8 每字約 3 bytes
+        for punctuated in (True, False):
+            text = make_transcript(size, punctuated)
+            self.stdout.write(f"{'有' if punctuated else '無'}標點逐字稿：{len(text)} 字")
+            self._run('dynamic_split', legacy_dynamic_split, text, options['repeat'])
+            self._run('split_transcript', split_transcript, text, options['repeat'])
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, Sum
+
+from core.llm_cache import prune
+from core.models import LLMCacheEntry
+
+
+class Command(BaseCommand):
+    help = '顯示 LLM 回應快取的命中統計，或手動淘汰／清空快取'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prune', action='store_true', help='依存放時間與容量上限淘汰項目')
+        parser.add_argument('--clear', action='store_true', help='清空所有快取項目')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            deleted, _ = LLMCacheEntry.objects.all().delete()
+            self.stdout.write(f"🧹 已清除 {deleted} 筆快取")
+            return
+        if options['prune']:
+            self.stdout.write(f"♻️ 已淘汰 {prune()} 筆快取")
+
+        totals = LLMCacheEntry.objects.aggregate(
+            entries=Count('id'),
+            size=Sum('size_bytes'),
+            hits=Sum('hit_count'),
+            saved_seconds=Sum(F('hit_count') * F('latency_seconds')),
+            saved_tokens=Sum(F('hit_count') * F('total_tokens')),
+        )
+        self.stdout.write(f"項目數：{totals['entries']}")
+        self.stdout.write(f"容量：{(totals['size'] or 0) / 1024 / 1024:.1f} MB")
+        self.stdout.write(f"累計命中：{totals['hits'] or 0}")
+        self.stdout.write(f"節省時間：{totals['saved_seconds'] or 0:.1f} 秒")
+        self.stdout.write(f"節省 tokens：{totals['saved_tokens'] or 0}")
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from core import metrics, page_cache
+
+
+class Command(BaseCommand):
+    help = '顯示頁面片段快取的命中率（各行程每 METRICS_FLUSH_SECONDS 秒寫入一次統計）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='統計歸零')
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            metrics.reset()
+            self.stdout.write("🧹 已將命中統計（連同 /metrics 的請求統計）歸零")
+            return
+        total_hits = total_lookups = 0
+        for name, item in page_cache.stats().items():
+            lookups = item['hits'] + item['misses']
+            total_hits += item['hits']
+            total_lookups += lookups
+            self.stdout.write(f"{name:<16} 命中 {item['hits']:>8} / {lookups:<8} 命中率 {item['hit_ratio'] * 100:5.1f}%")
+        ratio = total_hits / total_lookups * 100 if total_lookups else 0
+        self.stdout.write(f"{'合計':<14} 命中 {total_hits:>8} / {total_lookups:<8} 命中率 {ratio:5.1f}%")
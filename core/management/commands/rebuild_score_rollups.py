@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from core.grading import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = '由作答紀錄重新計算學生的講次與知識概念統計表'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--student', type=int, action='append', dest='students',
+                            help='只重建指定學生（可重複指定），預設重建全部')
+
+    def handle(self, *args, **options):
+        lectures, concepts = rebuild_rollups(options['students'])
+        self.stdout.write(f"📊 已重建 {lectures} 筆講次統計、{concepts} 筆知識概念統計")
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from core import search
+
+
+class Command(BaseCommand):
+    help = '重新建立講次全文檢索索引（SQLite FTS5；MySQL 的 FULLTEXT 索引由資料庫自動維護）'
+
+    def handle(self, *args, **options):
+        if search.backend() != 'fts5':
+            self.stdout.write(f"目前資料庫使用 {search.backend()}，不需重建")
+            return
+        self.stdout.write(f"🔍 已重建 {search.rebuild_index()} 筆講次索引")
@@ -0,0 +1,55 @@
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.ai_modules import warm_up_whisper_models
+from core.jobs import DEFAULT_VISIBILITY_TIMEOUT, make_worker_id, work_loop
+
+
+class Command(BaseCommand):
+    help = '處理講次背景工作（語音轉錄、摘要與出題）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=1, help='同時處理的工作數')
+        parser.add_argument('--visibility-timeout', type=int, default=DEFAULT_VISIBILITY_TIMEOUT,
+                            help='租約秒數，worker 未續約超過此時間工作會被重新領取')
+        parser.add_argument('--poll-interval', type=float, default=5, help='佇列為空時的輪詢間隔（秒）')
+        parser.add_argument('--once', action='store_true', help='處理完目前佇列後即結束')
+
+    def handle(self, *args, **options):
+        # worker 完成講次後清除的頁面快取版本要讓網站行程看到，locmem 只存在本行程內
+        if settings.CACHE_BACKEND not in settings.SHARED_CACHE_BACKENDS:
+            raise CommandError(
+                f"CACHE_BACKEND={settings.CACHE_BACKEND} 無法與網站行程共用，"
+                f"請改用 {' / '.join(settings.SHARED_CACHE_BACKENDS)}（網站與 worker 需設定相同）"
+            )
+        warm_up_whisper_models()
+
+        stop_event = threading.Event()
+        threads = [
+            threading.Thread(
+                target=work_loop,
+                args=(make_worker_id(i), stop_event),
+                kwargs={
+                    'visibility_timeout': options['visibility_timeout'],
+                    'poll_interval': options['poll_interval'],
+                    'once': options['once'],
+                },
+                daemon=True,
+            )
+            for i in range(max(1, options['concurrency']))
+        ]
+        for t in threads:
+            t.start()
+        self.stdout.write(self.style.SUCCESS(f"🚀 worker 已啟動（concurrency={len(threads)}）"))
+
+        try:
+            for t in threads:
+                while t.is_alive():
+                    t.join(timeout=1)
+        except KeyboardInterrupt:
+            self.stdout.write("🛑 收到中斷，等待執行中的工作結束…")
+            stop_event.set()
+            for t in threads:
+                t.join()
@@ -0,0 +1,168 @@
+# core/metrics.py
+# 請求效能統計：每個 view 的耗時 / 查詢數 / 查詢時間直方圖與 N+1 計數，以 Prometheus 文字格式輸出
+# 統計先累計在行程記憶體，定期把快照寫進 Django 快取；使用 file / db 快取後端時 /metrics 會合併所有 worker
+import hmac
+import os
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+METRICS_FLUSH_SECONDS = int(os.getenv('METRICS_FLUSH_SECONDS', '10'))
+METRICS_SNAPSHOT_SECONDS = int(os.getenv('METRICS_SNAPSHOT_SECONDS', str(24 * 3600)))
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+HISTOGRAMS = {
+    'django_request_duration_seconds': ('每個請求的處理時間（秒）', DURATION_BUCKETS),
+    'django_request_db_queries': ('每個請求執行的 SQL 數', QUERY_COUNT_BUCKETS),
+    'django_request_db_duration_seconds': ('每個請求的 SQL 總時間（秒）', DURATION_BUCKETS),
+}
+COUNTERS = {
+    'django_responses_total': '依 view 與狀態碼分類的回應數',
+    'django_n_plus_one_requests_total': '出現重複查詢形狀（疑似 N+1）的請求數',
+    'django_slow_requests_total': '超過 SLOW_REQUEST_MS 的請求數',
+    'page_cache_hits_total': '頁面片段快取命中次數',
+    'page_cache_misses_total': '頁面片段快取未命中次數',
+}
+
+_PROCESSES_KEY = 'request_metrics:processes'
+_PROCESS_KEY = f'request_metrics:{socket.gethostname()}:{os.getpid()}'
+
+_lock = threading.Lock()
+_histograms = {}  # (metric, view) -> [各 bucket 筆數（最後一格為 +Inf）, 總和, 筆數]
+_counters = {}    # (metric, labels) -> 值
+_last_flush = 0.0
+
+
+def observe(view, duration, query_count, query_seconds, status, n_plus_one=False, slow=False):
+    with _lock:
+        for metric, value in (
+            ('django_request_duration_seconds', duration),
+            ('django_request_db_queries', query_count),
+            ('django_request_db_duration_seconds', query_seconds),
+        ):
+            buckets = HISTOGRAMS[metric][1]
+            item = _histograms.get((metric, view))
+            if item is None:
+                item = _histograms[(metric, view)] = [[0] * (len(buckets) + 1), 0.0, 0]
+            index = next((i for i, bound in enumerate(buckets) if value <= bound), len(buckets))
+            item[0][index] += 1
+            item[1] += value
+            item[2] += 1
+        _inc('django_responses_total', (('view', view), ('status', str(status))))
+        if n_plus_one:
+            _inc('django_n_plus_one_requests_total', (('view', view),))
+        if slow:
+            _inc('django_slow_requests_total', (('view', view),))
+    _maybe_flush()
+
+
+def _inc(metric, labels):
+    _counters[(metric, labels)] = _counters.get((metric, labels), 0) + 1
+
+
+def increment(metric, labels):
+    """累加計數器；和請求統計一樣先存在行程記憶體，定期才寫入快取。"""
+    with _lock:
+        _inc(metric, labels)
+    _maybe_flush()
+
+
+def _snapshot():
+    with _lock:
+        return {
+            'histograms': {key: [list(item[0]), item[1], item[2]] for key, item in _histograms.items()},
+            'counters': dict(_counters),
+        }
+
+
+def _maybe_flush(force=False):
+    global _last_flush
+    now = time.monotonic()
+    if not force and now - _last_flush < METRICS_FLUSH_SECONDS:
+        return
+    _last_flush = now
+    cache.set(_PROCESS_KEY, _snapshot(), METRICS_SNAPSHOT_SECONDS)
+    processes = cache.get(_PROCESSES_KEY) or []
+    if _PROCESS_KEY not in processes:
+        cache.set(_PROCESSES_KEY, processes + [_PROCESS_KEY], None)
+
+
+def collect():
+    """合併本行程即時數據與其他 worker 在快取中的快照；已過期的行程會從清單移除。"""
+    merged = _snapshot()
+    processes = cache.get(_PROCESSES_KEY) or []
+    others = [key for key in processes if key != _PROCESS_KEY]
+    snapshots = cache.get_many(others) if others else {}
+    if len(snapshots) < len(others):
+        alive = [key for key in processes if key == _PROCESS_KEY or key in snapshots]
+        cache.set(_PROCESSES_KEY, alive, None)
+    for snapshot in snapshots.values():
+        for key, (counts, total, count) in snapshot['histograms'].items():
+            item = merged['histograms'].setdefault(key, [[0] * len(counts), 0.0, 0])
+            item[0] = [a + b for a, b in zip(item[0], counts)]
+            item[1] += total
+            item[2] += count
+        for key, value in snapshot['counters'].items():
+            merged['counters'][key] = merged['counters'].get(key, 0) + value
+    return merged
+
+
+def reset():
+    global _histograms, _counters
+    with _lock:
+        _histograms, _counters = {}, {}
+    processes = cache.get(_PROCESSES_KEY) or []
+    cache.delete_many(processes + [_PROCESSES_KEY])
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def is_authorized(request):
+    """管理員帳號，或帶有 settings.METRICS_TOKEN 的 Bearer token（不信任來源 IP，反向代理後一律是 127.0.0.1）。"""
+    if request.user.is_staff:
+        return True
+    scheme, _, token = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    return bool(settings.METRICS_TOKEN) and scheme.lower() == 'bearer' and hmac.compare_digest(
+        token.strip().encode(), settings.METRICS_TOKEN.encode())
+
+
+def render_prometheus():
+    data = collect()
+    lines = []
+    for metric, (help_text, buckets) in HISTOGRAMS.items():
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} histogram')
+        for (name, view), (counts, total, count) in sorted(data['histograms'].items()):
+            if name != metric:
+                continue
+            cumulative = 0
+            for bound, bucket_count in zip(buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                lines.append(f'{metric}_bucket{_labels((("view", view), ("le", str(bound))))} {cumulative}')
+            lines.append(f'{metric}_sum{_labels((("view", view),))} {_number(total)}')
+            lines.append(f'{metric}_count{_labels((("view", view),))} {count}')
+
+    for metric, help_text in COUNTERS.items():
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} counter')
+        for (name, labels), value in sorted(data['counters'].items()):
+            if name == metric:
+                lines.append(f'{metric}{_labels(labels)} {value}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,123 @@
+# core/middleware.py
+# 請求效能量測：記錄每個請求的耗時、SQL 數與 SQL 時間，偵測重複的查詢形狀（N+1），並可寫出慢請求紀錄
+import json
+import os
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+from functools import partial
+
+from django.db import connections
+from django.utils import timezone
+
+from . import metrics
+
+NPLUSONE_THRESHOLD = int(os.getenv('NPLUSONE_THRESHOLD', '10'))  # 同一形狀的查詢重複幾次視為 N+1
+SLOW_REQUEST_MS = int(os.getenv('SLOW_REQUEST_MS', '0'))          # 0 表示不記錄慢請求
+SLOW_REQUEST_LOG = os.getenv('SLOW_REQUEST_LOG', '')              # 未設定時印在標準輸出
+SLOW_REQUEST_TOP_QUERIES = 10
+
+_IN_LIST_RE = re.compile(r'\((?:%s, )+%s\)')
+_NUMBER_RE = re.compile(r'\b\d+\b')
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+
+
+def query_shape(sql):
+    """去掉參數差異後的 SQL：IN (%s, %s, ...) 與行內常數都視為相同形狀。"""
+    sql = _IN_LIST_RE.sub('(...)', sql)
+    sql = _STRING_RE.sub('?', sql)
+    return _NUMBER_RE.sub('?', sql)
+
+
+class _QueryRecorder:
+    def __init__(self):
+        self.queries = []  # (sql, params, 秒數)
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, params, time.perf_counter() - started))
+
+    @property
+    def total_seconds(self):
+        return sum(seconds for _, _, seconds in self.queries)
+
+    def repeated_shapes(self):
+        counts = Counter(query_shape(sql) for sql, _, _ in self.queries)
+        return [(shape, count) for shape, count in counts.most_common() if count >= NPLUSONE_THRESHOLD]
+
+
+class RequestMetricsMiddleware:
+    """放在 MIDDLEWARE 最前面，量到的時間才包含其他 middleware。
+
+    串流回應（成績匯出）在回應關閉時才結算，查詢數與時間包含產生內容時的分批查詢。
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        recorder = _QueryRecorder()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(recorder))
+            response = self.get_response(request)
+            if response.streaming:
+                # 交給 response.close() 結算：WSGI 伺服器在用戶端中途斷線、甚至尚未開始輸出時也會呼叫，
+                # 查詢攔截器一定會被移除
+                response._resource_closers.append(
+                    partial(self._close, stack.pop_all(), request, response, recorder, started))
+                return response
+        self._finish(request, response, recorder, started)
+        return response
+
+    def _close(self, stack, request, response, recorder, started):
+        try:
+            stack.close()
+        finally:
+            self._finish(request, response, recorder, started)
+
+    def _finish(self, request, response, recorder, started):
+        duration = time.perf_counter() - started
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else '<unresolved>'
+        repeated = recorder.repeated_shapes()
+        slow = SLOW_REQUEST_MS > 0 and duration * 1000 >= SLOW_REQUEST_MS
+
+        metrics.observe(view, duration, len(recorder.queries), recorder.total_seconds,
+                        response.status_code, n_plus_one=bool(repeated), slow=slow)
+        if not response.streaming:
+            response['Server-Timing'] = (f'total;dur={duration * 1000:.1f}, '
+                                         f'db;dur={recorder.total_seconds * 1000:.1f};desc="{len(recorder.queries)} queries"')
+        if repeated:
+            shape, count = repeated[0]
+            print(f"⚠️ 疑似 N+1：{view} 同一查詢執行 {count} 次：{shape[:200]}")
+        if slow:
+            self._log_slow(request, view, duration, recorder, repeated)
+
+    def _log_slow(self, request, view, duration, recorder, repeated):
+        slowest = sorted(recorder.queries, key=lambda q: q[2], reverse=True)[:SLOW_REQUEST_TOP_QUERIES]
+        entry = {
+            'time': timezone.now().isoformat(),
+            'method': request.method,
+            'path': request.get_full_path(),
+            'view': view,
+            'duration_ms': round(duration * 1000, 1),
+            'query_count': len(recorder.queries),
+            'query_ms': round(recorder.total_seconds * 1000, 1),
+            'repeated': [{'count': count, 'sql': shape} for shape, count in repeated],
+            'slowest': [{'ms': round(seconds * 1000, 2), 'sql': sql, 'params': repr(params)}
+                        for sql, params, seconds in slowest],
+        }
+        if SLOW_REQUEST_LOG:
+            with open(SLOW_REQUEST_LOG, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        else:
+            print(f"🐢 慢請求 {request.method} {entry['path']}（{view}）{entry['duration_ms']}ms，"
+                  f"SQL {entry['query_count']} 筆 / {entry['query_ms']}ms")
+            for item in entry['slowest'][:3]:
+                print(f"   {item['ms']}ms  {item['sql'][:300]}")
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.3 on 2026-10-18 08:07
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def mark_existing_lectures(apps, schema_editor):
+    # 既有講次都是同步處理完的：有摘要與題目視為完成，其餘不會再有工作接手，標記為失敗
+    Lecture = apps.get_model('core', 'Lecture')
+    Lecture.objects.exclude(summary='').filter(question__isnull=False).update(status='done')
+    Lecture.objects.exclude(status='done').update(status='failed')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_alter_question_question_type'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lecture',
+            name='status',
+            field=models.CharField(choices=[('queued', '排隊中'), ('transcribing', '語音轉錄中'), ('summarizing', '摘要產生中'), ('generating', '題目產生中'), ('done', '已完成'), ('failed', '處理失敗')], default='queued', max_length=20),
+        ),
+        migrations.CreateModel(
+            name='LectureJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('num_mcq', models.PositiveIntegerField(default=3)),
+                ('num_tf', models.PositiveIntegerField(default=0)),
+                ('status', models.CharField(choices=[('pending', '等待中'), ('running', '執行中'), ('done', '已完成'), ('failed', '失敗')], default='pending', max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('max_attempts', models.PositiveIntegerField(default=3)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now)),
+                ('locked_by', models.CharField(blank=True, max_length=100)),
+                ('locked_until', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('lecture', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to='core.lecture')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'run_after'], name='core_lectur_status_fb5109_idx')],
+            },
+        ),
+        migrations.RunPython(mark_existing_lectures, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.3 on 2026-10-18 08:09
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_lecture_status_lecturejob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LLMCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('model', models.CharField(max_length=100)),
+                ('response_json', models.TextField()),
+                ('size_bytes', models.PositiveIntegerField(default=0)),
+                ('latency_seconds', models.FloatField(default=0)),
+                ('total_tokens', models.PositiveIntegerField(default=0)),
+                ('hit_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_hit_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['last_hit_at'], name='core_llmcac_last_hi_46e551_idx'), models.Index(fields=['created_at'], name='core_llmcac_created_c4bfe3_idx')],
+            },
+        ),
+    ]
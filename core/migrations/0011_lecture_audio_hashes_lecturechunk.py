@@ -0,0 +1,38 @@
+# Generated by Django 5.2.3 on 2026-10-18 08:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_llmcacheentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lecture',
+            name='audio_sha256',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='lecture',
+            name='pcm_sha256',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.CreateModel(
+            name='LectureChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveIntegerField()),
+                ('chunk_hash', models.CharField(db_index=True, max_length=64)),
+                ('summary', models.TextField()),
+                ('lecture', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='core.lecture')),
+            ],
+            options={
+                'ordering': ['index'],
+                'constraints': [models.UniqueConstraint(fields=('lecture', 'index'), name='unique_lecture_chunk_index')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-18 08:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_lecture_audio_hashes_lecturechunk'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lecture',
+            name='transcript_segments',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
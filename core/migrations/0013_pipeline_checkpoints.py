@@ -0,0 +1,23 @@
+# Generated by Django 5.2.3 on 2026-10-18 08:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_lecture_transcript_segments'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lecture',
+            name='summary_source_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='lecturejob',
+            name='regenerate_questions',
+            field=models.BooleanField(default=False),
+        ),
+    ]
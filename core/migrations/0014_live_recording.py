@@ -0,0 +1,33 @@
+# Generated by Django 5.2.3 on 2026-10-18 08:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_pipeline_checkpoints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lecture',
+            name='live_transcribed_seconds',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='lecture',
+            name='recorded_chunks',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='lecturejob',
+            name='kind',
+            field=models.CharField(choices=[('process', '完整處理'), ('live', '即時轉錄')], default='process', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='lecture',
+            name='status',
+            field=models.CharField(choices=[('recording', '錄音中'), ('queued', '排隊中'), ('transcribing', '語音轉錄中'), ('summarizing', '摘要產生中'), ('generating', '題目產生中'), ('done', '已完成'), ('failed', '處理失敗')], default='queued', max_length=20),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.3 on 2026-10-18 08:17
+
+from django.db import migrations, models
+
+
+def remove_duplicate_submissions(apps, schema_editor):
+    # 同一題重複送出時只保留最早的一筆，才能加上唯一限制
+    Submission = apps.get_model('core', 'Submission')
+    seen = set()
+    duplicate_ids = []
+    for sub_id, student_id, question_id in Submission.objects.order_by('submitted_at', 'id').values_list(
+            'id', 'student_id', 'question_id').iterator():
+        key = (student_id, question_id)
+        if key in seen:
+            duplicate_ids.append(sub_id)
+        else:
+            seen.add(key)
+    for start in range(0, len(duplicate_ids), 500):
+        Submission.objects.filter(id__in=duplicate_ids[start:start + 500]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_live_recording'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='submission',
+            name='student_answer',
+            field=models.CharField(blank=True, max_length=10),
+        ),
+        migrations.RunPython(remove_duplicate_submissions, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='submission',
+            constraint=models.UniqueConstraint(fields=('student', 'question'), name='unique_student_question_submission'),
+        ),
+    ]
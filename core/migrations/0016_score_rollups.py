@@ -0,0 +1,63 @@
+# Generated by Django 5.2.3 on 2026-10-18 08:19
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import Count, Max, Q
+
+
+def build_rollups(apps, schema_editor):
+    # 由既有作答紀錄產生統計表
+    Submission = apps.get_model('core', 'Submission')
+    LectureScore = apps.get_model('core', 'LectureScore')
+    ConceptScore = apps.get_model('core', 'ConceptScore')
+    counts = dict(total=Count('id'), correct=Count('id', filter=Q(is_correct=True)))
+    LectureScore.objects.bulk_create([
+        LectureScore(student_id=row['student_id'], lecture_id=row['question__lecture_id'],
+                     total=row['total'], correct=row['correct'], last_submitted_at=row['last_submitted_at'])
+        for row in Submission.objects.values('student_id', 'question__lecture_id')
+        .annotate(last_submitted_at=Max('submitted_at'), **counts).order_by()
+    ], batch_size=500)
+    ConceptScore.objects.bulk_create([
+        ConceptScore(student_id=row['student_id'], concept=row['question__concept'],
+                     total=row['total'], correct=row['correct'])
+        for row in Submission.objects.values('student_id', 'question__concept').annotate(**counts).order_by()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_submission_unique_student_question'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConceptScore',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('concept', models.CharField(max_length=100)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('correct', models.PositiveIntegerField(default=0)),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='concept_scores', to='core.student')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('student', 'concept'), name='unique_student_concept_score')],
+            },
+        ),
+        migrations.CreateModel(
+            name='LectureScore',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('correct', models.PositiveIntegerField(default=0)),
+                ('last_submitted_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('lecture', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='scores', to='core.lecture')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lecture_scores', to='core.student')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('student', 'lecture'), name='unique_student_lecture_score')],
+            },
+        ),
+        migrations.RunPython(build_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,54 @@
+import re
+
+from django.db import migrations
+
+FTS_TABLE = 'core_lecture_fts'
+MYSQL_INDEX = 'core_lecture_fulltext'
+_CJK_CHAR_RE = re.compile('([぀-ヿ㐀-䶿一-鿿豈-﫿가-힯])')
+_SPACES_RE = re.compile(r'\s+')
+
+
+def _spaced(text):
+    # 與 core.search 相同：中日韓文字逐字以空白分開，讓 FTS5 可做子字串片語比對
+    return _SPACES_RE.sub(' ', _CJK_CHAR_RE.sub(r' \1 ', text or '')).strip()
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'mysql':
+        schema_editor.execute(
+            f"ALTER TABLE core_lecture ADD FULLTEXT INDEX {MYSQL_INDEX} (title, summary, transcript) WITH PARSER ngram"
+        )
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            f"title, summary, transcript, tokenize='unicode61 remove_diacritics 2')"
+        )
+        Lecture = apps.get_model('core', 'Lecture')
+        rows = [
+            (lec.id, _spaced(lec.title), _spaced(lec.summary), _spaced(lec.transcript))
+            for lec in Lecture.objects.only('id', 'title', 'summary', 'transcript').iterator()
+        ]
+        with schema_editor.connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {FTS_TABLE} (rowid, title, summary, transcript) VALUES (%s, %s, %s, %s)", rows
+            )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'mysql':
+        schema_editor.execute(f"ALTER TABLE core_lecture DROP INDEX {MYSQL_INDEX}")
+    elif vendor == 'sqlite':
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_score_rollups'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
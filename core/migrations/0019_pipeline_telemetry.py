@@ -0,0 +1,66 @@
+# Generated by Django 5.2.3 on 2026-10-18 08:35
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_submission_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PipelineRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('running', '執行中'), ('done', '已完成'), ('failed', '失敗')], default='running', max_length=20)),
+                ('started_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('total_seconds', models.FloatField(blank=True, null=True)),
+                ('whisper_model', models.CharField(blank=True, max_length=20)),
+                ('audio_seconds', models.FloatField(blank=True, null=True)),
+                ('speech_seconds', models.FloatField(blank=True, null=True)),
+                ('whisper_load_seconds', models.FloatField(blank=True, null=True)),
+                ('whisper_inference_seconds', models.FloatField(blank=True, null=True)),
+                ('real_time_factor', models.FloatField(blank=True, null=True)),
+                ('asr_segments', models.PositiveIntegerField(default=0)),
+                ('transcript_chunks', models.PositiveIntegerField(default=0)),
+                ('llm_calls', models.PositiveIntegerField(default=0)),
+                ('llm_retries', models.PositiveIntegerField(default=0)),
+                ('llm_failures', models.PositiveIntegerField(default=0)),
+                ('prompt_tokens', models.PositiveIntegerField(default=0)),
+                ('completion_tokens', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('lecture', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pipeline_runs', to='core.lecture')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PipelineStage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('stage', '階段'), ('llm', 'LLM 呼叫')], default='stage', max_length=10)),
+                ('name', models.CharField(max_length=30)),
+                ('label', models.CharField(blank=True, max_length=100)),
+                ('model', models.CharField(blank=True, max_length=100)),
+                ('started_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('seconds', models.FloatField(default=0)),
+                ('attempt', models.PositiveIntegerField(default=1)),
+                ('succeeded', models.BooleanField(default=True)),
+                ('prompt_tokens', models.PositiveIntegerField(default=0)),
+                ('completion_tokens', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stages', to='core.pipelinerun')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='pipelinerun',
+            index=models.Index(fields=['status', 'started_at'], name='core_pipeli_status_a068d2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pipelinestage',
+            index=models.Index(fields=['kind', 'name'], name='core_pipeli_kind_00857d_idx'),
+        ),
+    ]
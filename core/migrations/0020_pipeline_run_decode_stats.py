@@ -0,0 +1,28 @@
+# Generated by Django 5.2.3 on 2026-10-18 08:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_pipeline_telemetry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pipelinerun',
+            name='decode_seconds',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='pipelinerun',
+            name='stored_audio_bytes',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='pipelinerun',
+            name='wav_audio_bytes',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.3 on 2026-10-18 09:01
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_pipeline_run_decode_stats'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='pipelinerun',
+            name='wav_audio_bytes',
+        ),
+    ]
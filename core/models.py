@@ -1,5 +1,6 @@
 from django.contrib.auth.models import User
 from django.db import models
+from django.utils import timezone
 
 class Course(models.Model):
     name = models.CharField(max_length=200)
@@ -15,8 +16,153 @@ class Lecture(models.Model):
     title = models.CharField(max_length=100, blank=True, null=True)
     audio_file = models.FileField(upload_to='lectures/')
     transcript = models.TextField(blank=True)
+    transcript_segments = models.JSONField(default=list, blank=True)  # [{"start", "end", "text"}]，秒
     summary = models.TextField(blank=True)
+    recorded_chunks = models.PositiveIntegerField(default=0)  # 即時錄音已收到的分段數
+    live_transcribed_seconds = models.FloatField(default=0)   # 即時錄音已轉錄到的時間點（秒）
+    summary_source_hash = models.CharField(max_length=64, blank=True)  # 產生 summary 時各段摘要的雜湊，用於判斷是否需重算
     quiz_generated = models.BooleanField(default=False)
+    audio_sha256 = models.CharField(max_length=64, blank=True, db_index=True)  # 原始檔案位元組
+    pcm_sha256 = models.CharField(max_length=64, blank=True, db_index=True)    # 解碼後 16kHz 單聲道 PCM
+    status = models.CharField(
+        max_length=20,
+        choices=[
+            ('recording', '錄音中'),
+            ('queued', '排隊中'),
+            ('transcribing', '語音轉錄中'),
+            ('summarizing', '摘要產生中'),
+            ('generating', '題目產生中'),
+            ('done', '已完成'),
+            ('failed', '處理失敗'),
+        ],
+        default='queued'
+    )
+
+class LectureChunk(models.Model):
+    lecture = models.ForeignKey(Lecture, on_delete=models.CASCADE, related_name='chunks')
+    index = models.PositiveIntegerField()
+    chunk_hash = models.CharField(max_length=64, db_index=True)
+    summary = models.TextField()
+
+    class Meta:
+        ordering = ['index']
+        constraints = [
+            models.UniqueConstraint(fields=['lecture', 'index'], name='unique_lecture_chunk_index'),
+        ]
+
+class LectureJob(models.Model):
+    lecture = models.ForeignKey(Lecture, on_delete=models.CASCADE, related_name='jobs')
+    kind = models.CharField(
+        max_length=20,
+        choices=[
+            ('process', '完整處理'),
+            ('live', '即時轉錄'),
+        ],
+        default='process'
+    )
+    num_mcq = models.PositiveIntegerField(default=3)
+    num_tf = models.PositiveIntegerField(default=0)
+    regenerate_questions = models.BooleanField(default=False)  # 只重新產生題目，其餘階段沿用已完成的結果
+    status = models.CharField(
+        max_length=20,
+        choices=[
+            ('pending', '等待中'),
+            ('running', '執行中'),
+            ('done', '已完成'),
+            ('failed', '失敗'),
+        ],
+        default='pending'
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)  # 超過此時間未續約視為 worker 已死亡
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after']),
+        ]
+
+class LLMCacheEntry(models.Model):
+    key = models.CharField(max_length=64, unique=True)  # sha256(model + messages + 取樣參數)
+    model = models.CharField(max_length=100)
+    response_json = models.TextField()
+    size_bytes = models.PositiveIntegerField(default=0)
+    latency_seconds = models.FloatField(default=0)
+    total_tokens = models.PositiveIntegerField(default=0)
+    hit_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_hit_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['last_hit_at']),
+            models.Index(fields=['created_at']),
+        ]
+
+class PipelineRun(models.Model):
+    # 每次執行 process_audio_and_generate_quiz 的紀錄，供效能分析與估算 worker 數量
+    lecture = models.ForeignKey(Lecture, on_delete=models.CASCADE, related_name='pipeline_runs')
+    status = models.CharField(
+        max_length=20,
+        choices=[
+            ('running', '執行中'),
+            ('done', '已完成'),
+            ('failed', '失敗'),
+        ],
+        default='running'
+    )
+    started_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    total_seconds = models.FloatField(null=True, blank=True)
+    # 語音轉錄（沿用既有逐字稿時為空）
+    whisper_model = models.CharField(max_length=20, blank=True)
+    audio_seconds = models.FloatField(null=True, blank=True)
+    speech_seconds = models.FloatField(null=True, blank=True)
+    whisper_load_seconds = models.FloatField(null=True, blank=True)
+    whisper_inference_seconds = models.FloatField(null=True, blank=True)
+    real_time_factor = models.FloatField(null=True, blank=True)  # 轉錄時間 / 音訊長度
+    asr_segments = models.PositiveIntegerField(default=0)
+    # 音訊解碼：實測的解碼時間與存檔（原始壓縮格式）大小
+    decode_seconds = models.FloatField(null=True, blank=True)
+    stored_audio_bytes = models.PositiveBigIntegerField(null=True, blank=True)
+    transcript_chunks = models.PositiveIntegerField(default=0)
+    # LLM 呼叫（只計實際送出的請求，快取命中不計）
+    llm_calls = models.PositiveIntegerField(default=0)
+    llm_retries = models.PositiveIntegerField(default=0)
+    llm_failures = models.PositiveIntegerField(default=0)
+    prompt_tokens = models.PositiveIntegerField(default=0)
+    completion_tokens = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'started_at']),
+        ]
+
+class PipelineStage(models.Model):
+    # kind='stage' 為轉錄 / 摘要 / 整合 / 出題等階段的總耗時；kind='llm' 為每一次 LLM 請求
+    run = models.ForeignKey(PipelineRun, on_delete=models.CASCADE, related_name='stages')
+    kind = models.CharField(max_length=10, choices=[('stage', '階段'), ('llm', 'LLM 呼叫')], default='stage')
+    name = models.CharField(max_length=30)    # 統計分組用：transcribe、summary、reduce、mcq ...
+    label = models.CharField(max_length=100, blank=True)
+    model = models.CharField(max_length=100, blank=True)
+    started_at = models.DateTimeField(default=timezone.now)
+    seconds = models.FloatField(default=0)
+    attempt = models.PositiveIntegerField(default=1)
+    succeeded = models.BooleanField(default=True)
+    prompt_tokens = models.PositiveIntegerField(default=0)
+    completion_tokens = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['kind', 'name']),
+        ]
 
 class Question(models.Model):
     lecture = models.ForeignKey(Lecture, on_delete=models.CASCADE)
@@ -45,10 +191,50 @@ class Student(models.Model):
 class Submission(models.Model):
     student = models.ForeignKey(Student, on_delete=models.CASCADE)
     question = models.ForeignKey(Question, on_delete=models.CASCADE)
-    student_answer = models.CharField(max_length=1)
+    student_answer = models.CharField(max_length=10, blank=True)  # 選擇題 A–D，是非題 True/False
     is_correct = models.BooleanField()
     submitted_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['student', 'question'], name='unique_student_question_submission'),
+        ]
+        # 作答紀錄以 (submitted_at, id) 游標分頁，依學生或題目篩選時也能直接走索引
+        indexes = [
+            models.Index(fields=['submitted_at', 'id'], name='submission_time_idx'),
+            models.Index(fields=['student', 'submitted_at', 'id'], name='submission_student_time_idx'),
+            models.Index(fields=['question', 'submitted_at', 'id'], name='submission_question_time_idx'),
+        ]
+
+class LectureScore(models.Model):
+    # 每位學生每個講次的作答統計，批改時與 Submission 在同一個交易內累加
+    student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='lecture_scores')
+    lecture = models.ForeignKey(Lecture, on_delete=models.CASCADE, related_name='scores')
+    total = models.PositiveIntegerField(default=0)
+    correct = models.PositiveIntegerField(default=0)
+    last_submitted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['student', 'lecture'], name='unique_student_lecture_score'),
+        ]
+
+    @property
+    def accuracy(self):
+        return round(self.correct / self.total * 100, 2) if self.total else 0
+
+class ConceptScore(models.Model):
+    # 每位學生每個知識概念的作答統計
+    student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='concept_scores')
+    concept = models.CharField(max_length=100)
+    total = models.PositiveIntegerField(default=0)
+    correct = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['student', 'concept'], name='unique_student_concept_score'),
+        ]
+
 #class Profile(models.Model):
 #    user = models.OneToOneField(User, on_delete=models.CASCADE)
 #    role = models.CharField(max_length=10, choices=[('teacher', '老師'), ('student', '學生')])
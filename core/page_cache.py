@@ -0,0 +1,83 @@
+# core/page_cache.py
+# 頁面片段快取：片段 HTML 以「物件版本標記」為鍵，Course / Lecture / Question 變動時由 signals 清除版本即失效
+# CSRF token 以佔位字串存入快取，取出時換成目前請求的 token，含表單的片段也能共用
+import os
+import uuid
+
+from django.core.cache import cache
+from django.middleware.csrf import get_token
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from . import metrics
+
+PAGE_CACHE_SECONDS = int(os.getenv('PAGE_CACHE_SECONDS', '600'))
+FRAGMENTS = ('course_list', 'course_detail', 'lecture_detail', 'quiz')
+
+_CSRF_PLACEHOLDER = '__csrf_token_placeholder__'
+
+
+def _version_key(scope, obj_id=None):
+    return f'page_version:{scope}' if obj_id is None else f'page_version:{scope}:{obj_id}'
+
+
+def version(scope, obj_id=None):
+    key = _version_key(scope, obj_id)
+    token = cache.get(key)
+    if token is None:
+        token = uuid.uuid4().hex[:12]
+        if not cache.add(key, token, None):
+            token = cache.get(key) or token
+    return token
+
+
+def invalidate(scope, *obj_ids):
+    if obj_ids:
+        cache.delete_many([_version_key(scope, obj_id) for obj_id in obj_ids])
+    else:
+        cache.delete(_version_key(scope))
+
+
+def _count(name, outcome):
+    # 計數放在行程記憶體（與 /metrics 的請求統計一起定期寫入快取），不在每次瀏覽時寫共用快取
+    metrics.increment(f'page_cache_{outcome}_total', (('fragment', name),))
+
+
+def stats():
+    """回傳 {片段名稱: {'hits', 'misses', 'hit_ratio'}}；為所有行程最近一次寫入快取的統計總和。"""
+    counters = metrics.collect()['counters']
+    report = {}
+    for name in FRAGMENTS:
+        hits = counters.get(('page_cache_hits_total', (('fragment', name),)), 0)
+        misses = counters.get(('page_cache_misses_total', (('fragment', name),)), 0)
+        lookups = hits + misses
+        report[name] = {'hits': hits, 'misses': misses, 'hit_ratio': hits / lookups if lookups else 0.0}
+    return report
+
+
+def render_fragment(request, name, key_parts, template_name, build_context, cacheable=True):
+    """取出或產生片段 HTML；build_context 只在未命中時呼叫，查詢都放在裡面。
+
+    key_parts 須包含片段內容依賴的所有版本標記與會影響輸出的條件（例如角色、講次狀態）。
+    內容仍在處理中（講次尚未完成）時傳入 cacheable=False，每次重新產生且不寫入快取。
+    """
+    key = 'fragment:' + name + ':' + ':'.join(str(part) for part in key_parts)
+    html = cache.get(key) if cacheable else None
+    if html is None:
+        _count(name, 'misses')
+        context = build_context()
+        context['csrf_token'] = _CSRF_PLACEHOLDER
+        html = render_to_string(template_name, context)
+        if cacheable:
+            cache.set(key, html, PAGE_CACHE_SECONDS)
+    else:
+        _count(name, 'hits')
+    if _CSRF_PLACEHOLDER in html:
+        html = html.replace(_CSRF_PLACEHOLDER, get_token(request))
+    return mark_safe(html)
+
+
+def user_role(request):
+    if request.user.is_authenticated and hasattr(request.user, 'profile'):
+        return request.user.profile.role
+    return 'anonymous'
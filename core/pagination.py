@@ -0,0 +1,75 @@
+# core/pagination.py
+# Keyset（游標）分頁：以上一頁最後一筆的排序鍵作為下一頁的起點，深頁與第一頁成本相同
+import base64
+import json
+
+from django.db.models import Q
+
+PAGE_SIZE = 50
+
+
+def _json_default(value):
+    # 保留完整的微秒；DjangoJSONEncoder 會截到毫秒，相同秒內的資料會在換頁時漏掉
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+def encode_cursor(values):
+    raw = json.dumps(values, default=_json_default, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, model, fields):
+    """解析游標並依欄位型別轉回 Python 值；格式不符時回傳 None（視為第一頁）。"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list) or len(values) != len(fields):
+            return None
+        return [model._meta.get_field(f).to_python(v) for f, v in zip(fields, values)]
+    except Exception:
+        return None
+
+
+def _after(fields, values, descending):
+    # (a, b, id) 的字典序比較展開成 a < x OR (a = x AND b < y) OR ...，每個分支都能用複合索引
+    op = 'lt' if descending else 'gt'
+    condition = Q()
+    for i, field in enumerate(fields):
+        branch = Q(**{f'{field}__{op}': values[i]})
+        for prev_field, prev_value in zip(fields[:i], values[:i]):
+            branch &= Q(**{prev_field: prev_value})
+        condition |= branch
+    return condition
+
+
+def keyset_page(queryset, fields, cursor=None, page_size=PAGE_SIZE, descending=True):
+    """依 fields 排序取出一頁，回傳 (rows, next_cursor)；最後一個欄位須唯一（通常為 id）。"""
+    ordering = [('-' if descending else '') + f for f in fields]
+    queryset = queryset.order_by(*ordering)
+    values = decode_cursor(cursor, queryset.model, fields)
+    if values is not None:
+        queryset = queryset.filter(_after(fields, values, descending))
+
+    rows = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor([getattr(rows[-1], f) for f in fields])
+    return rows, next_cursor
+
+
+def iterate_keyset(queryset, fields, batch_size=2000, descending=False):
+    """依 keyset 分批走訪整個 queryset，一次只有一批在記憶體中（大量匯出使用）。
+
+    MySQL 的 mysqlclient 即使用 iterator() 也會把整個結果集讀進用戶端，分批查詢才能讓記憶體保持固定。
+    """
+    cursor = None
+    while True:
+        rows, cursor = keyset_page(queryset, fields, cursor, batch_size, descending)
+        yield from rows
+        if cursor is None:
+            return
@@ -0,0 +1,177 @@
+# core/search.py
+# 講次全文檢索：SQLite 使用 FTS5 虛擬表，MySQL 使用 ngram parser 的 FULLTEXT 索引，其他資料庫退回 icontains
+# 涵蓋標題、摘要與逐字稿，依相關度排序並回傳標示關鍵字的片段
+import os
+import re
+
+from django.db import connection
+from django.db.models import Q
+from django.utils.html import escape
+
+from .models import Lecture
+
+SEARCH_MAX_RESULTS = int(os.getenv('SEARCH_MAX_RESULTS', '500'))
+SNIPPET_CHARS = 60
+
+FTS_TABLE = 'core_lecture_fts'
+INDEXED_FIELDS = ('title', 'summary', 'transcript')
+# bm25 權重：標題 > 摘要 > 逐字稿
+FTS_WEIGHTS = (5.0, 2.0, 1.0)
+
+_MARK_START, _MARK_END = '\x02', '\x03'
+_CJK_RANGES = ((0x3040, 0x30FF), (0x3400, 0x4DBF), (0x4E00, 0x9FFF), (0xF900, 0xFAFF), (0xAC00, 0xD7AF))
+_CJK = ''.join(f'{chr(lo)}-{chr(hi)}' for lo, hi in _CJK_RANGES)
+# str.translate 逐字替換比 regex 反向參照快數倍，索引長逐字稿時差異明顯
+_CJK_SPACING = {c: f' {chr(c)} ' for lo, hi in _CJK_RANGES for c in range(lo, hi + 1)}
+_CJK_GAP_RE = re.compile(f'(?<=[{_CJK}{_MARK_START}{_MARK_END}]) (?=[{_CJK}{_MARK_START}{_MARK_END}])')
+_SPACES_RE = re.compile(r'\s+')
+
+
+def backend():
+    return {'sqlite': 'fts5', 'mysql': 'mysql'}.get(connection.vendor, 'icontains')
+
+
+def query_terms(query):
+    return [t for t in _SPACES_RE.split(query.replace('"', ' ').strip()) if t]
+
+
+# ---------- SQLite FTS5 ----------
+# unicode61 分詞器會把連續的中日韓文字視為一個詞，先在每個字之間插入空白，
+# 再以片語查詢（相鄰字元）達到任意長度的子字串比對；虛擬表由 migration 0017 建立
+
+def _spaced(text):
+    return ' '.join((text or '').translate(_CJK_SPACING).split())
+
+
+def _unspaced(text):
+    return _CJK_GAP_RE.sub('', text)
+
+
+def _fts_match(terms):
+    return ' '.join('"' + _spaced(t) + '"' for t in terms)
+
+
+def _fts_rows(lectures):
+    return [
+        (lec.id, *(_spaced(getattr(lec, field)) for field in INDEXED_FIELDS))
+        for lec in lectures
+    ]
+
+
+# ---------- 索引維護 ----------
+
+def index_lectures(lectures):
+    """新增或更新講次的索引（儲存講次後呼叫）；MySQL 的 FULLTEXT 索引由資料庫自動維護。"""
+    if backend() != 'fts5':
+        return
+    rows = _fts_rows(lectures)
+    if not rows:
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [(row[0],) for row in rows])
+        cursor.executemany(
+            f"INSERT INTO {FTS_TABLE} (rowid, {', '.join(INDEXED_FIELDS)}) VALUES (%s, %s, %s, %s)", rows
+        )
+
+
+def remove_lecture(lecture_id):
+    if backend() != 'fts5':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [lecture_id])
+
+
+def rebuild_index(batch_size=500):
+    """清空後重新建立全部講次的索引，回傳索引筆數。"""
+    if backend() != 'fts5':
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+    lectures = Lecture.objects.only('id', *INDEXED_FIELDS).order_by('id')
+    count = 0
+    batch = []
+    for lecture in lectures.iterator(chunk_size=batch_size):
+        batch.append(lecture)
+        if len(batch) >= batch_size:
+            index_lectures(batch)
+            count += len(batch)
+            batch = []
+    index_lectures(batch)
+    return count + len(batch)
+
+
+# ---------- 查詢 ----------
+
+def search_lecture_ids(query, limit=SEARCH_MAX_RESULTS):
+    """回傳依相關度排序的講次 id（最多 limit 筆）。"""
+    terms = query_terms(query)
+    if not terms:
+        return []
+    engine = backend()
+    with connection.cursor() as cursor:
+        if engine == 'fts5':
+            cursor.execute(
+                f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s "
+                f"ORDER BY bm25({FTS_TABLE}, {', '.join(map(str, FTS_WEIGHTS))}) LIMIT %s",
+                [_fts_match(terms), limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+        if engine == 'mysql':
+            against = ' '.join(f'+"{t}"' for t in terms)
+            cursor.execute(
+                f"SELECT id FROM {Lecture._meta.db_table} "
+                f"WHERE MATCH({', '.join(INDEXED_FIELDS)}) AGAINST (%s IN BOOLEAN MODE) "
+                f"ORDER BY MATCH({', '.join(INDEXED_FIELDS)}) AGAINST (%s IN BOOLEAN MODE) DESC LIMIT %s",
+                [against, against, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    lectures = Lecture.objects.all()
+    for term in terms:
+        lectures = lectures.filter(
+            Q(title__icontains=term) | Q(summary__icontains=term) | Q(transcript__icontains=term)
+        )
+    return list(lectures.order_by('-id').values_list('id', flat=True)[:limit])
+
+
+def _highlight(text):
+    return escape(text).replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>')
+
+
+def _python_snippet(texts, terms, width=SNIPPET_CHARS):
+    pattern = re.compile('|'.join(re.escape(t) for t in terms), re.IGNORECASE)
+    for text in texts:
+        match = pattern.search(text or '')
+        if not match:
+            continue
+        start = max(0, match.start() - width // 3)
+        end = min(len(text), start + width)
+        window = pattern.sub(lambda m: _MARK_START + m.group(0) + _MARK_END, text[start:end])
+        prefix = '…' if start > 0 else ''
+        suffix = '…' if end < len(text) else ''
+        return prefix + _highlight(_SPACES_RE.sub(' ', window)) + suffix
+    return ''
+
+
+def search_snippets(query, lecture_ids):
+    """回傳 {lecture_id: 標示關鍵字的 HTML 片段}，只針對目前頁面的講次計算。"""
+    terms = query_terms(query)
+    lecture_ids = list(lecture_ids)
+    if not terms or not lecture_ids:
+        return {}
+
+    if backend() == 'fts5':
+        placeholders = ', '.join(['%s'] * len(lecture_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid, snippet({FTS_TABLE}, -1, %s, %s, '…', 40) FROM {FTS_TABLE} "
+                f"WHERE {FTS_TABLE} MATCH %s AND rowid IN ({placeholders})",
+                [_MARK_START, _MARK_END, _fts_match(terms), *lecture_ids],
+            )
+            return {row[0]: _highlight(_unspaced(row[1])) for row in cursor.fetchall()}
+
+    lectures = Lecture.objects.filter(id__in=lecture_ids).only('id', *INDEXED_FIELDS)
+    return {
+        lec.id: _python_snippet((lec.summary, lec.transcript, lec.title), terms)
+        for lec in lectures
+    }
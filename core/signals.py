@@ -1,8 +1,10 @@
 # signals.py
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import Profile, Student
+from .models import Course, Lecture, Profile, Question, Student
+from . import page_cache, search
+from .grading import invalidate_lecture_results
 
 #@receiver(post_save, sender=User)
 #def create_profile(sender, instance, created, **kwargs):
@@ -41,3 +43,48 @@ def create_profile_and_student(sender, instance, created, **kwargs):
 
         # 自動建立 Student
         Student.objects.create(user=instance, name=instance.username, email=instance.email)
+
+
+# 🔍 講次儲存時同步更新全文檢索索引（只在標題、摘要或逐字稿可能變動時）
+@receiver(post_save, sender=Lecture)
+def index_lecture(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not set(update_fields) & set(search.INDEXED_FIELDS):
+        return
+    search.index_lectures([instance])
+
+
+@receiver(post_delete, sender=Lecture)
+def unindex_lecture(sender, instance, **kwargs):
+    search.remove_lecture(instance.id)
+
+
+# 🧪 題目新增、修改或刪除時，讓該講次已快取的題目解析失效
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def invalidate_question_results(sender, instance, **kwargs):
+    invalidate_lecture_results(instance.lecture_id)
+
+
+# 🗂 頁面片段快取：只清除受影響物件的版本標記
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+def invalidate_course_pages(sender, instance, **kwargs):
+    page_cache.invalidate('courses')
+    page_cache.invalidate('course', instance.id)
+    # 測驗頁顯示課程名稱
+    lecture_ids = list(Lecture.objects.filter(course_id=instance.id).values_list('id', flat=True))
+    if lecture_ids:
+        page_cache.invalidate('lecture', *lecture_ids)
+
+
+@receiver(post_save, sender=Lecture)
+@receiver(post_delete, sender=Lecture)
+def invalidate_lecture_pages(sender, instance, **kwargs):
+    page_cache.invalidate('lecture', instance.id)
+    page_cache.invalidate('course', instance.course_id)
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def invalidate_question_pages(sender, instance, **kwargs):
+    page_cache.invalidate('lecture', instance.lecture_id)
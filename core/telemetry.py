@@ -0,0 +1,276 @@
+# core/telemetry.py
+# 處理管線執行紀錄：各階段耗時、Whisper 轉錄統計，以及每次 LLM 請求的延遲、token 數、重試與失敗
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.utils import timezone
+
+from .models import PipelineRun, PipelineStage
+
+# 估算費用用的單價（美元 / 百萬 token），預設為 gpt-4o 定價
+LLM_PROMPT_PRICE_PER_1M = float(os.getenv("LLM_PROMPT_PRICE_PER_1M", "2.5"))
+LLM_COMPLETION_PRICE_PER_1M = float(os.getenv("LLM_COMPLETION_PRICE_PER_1M", "10"))
+# 串流請求加上 stream_options.include_usage 才拿得到 token 數；相容 API 不支援時可關閉
+LLM_STREAM_USAGE = os.getenv("LLM_STREAM_USAGE", "1") == "1"
+PIPELINE_STATS_RUNS = int(os.getenv("PIPELINE_STATS_RUNS", "200"))
+
+_local = threading.local()
+
+
+@contextmanager
+def llm_call(name, label="", attempt=1):
+    """標記目前執行緒接下來送出的 LLM 請求屬於哪一類，寫入紀錄時用來分組。"""
+    previous = getattr(_local, "call", None)
+    _local.call = (name, label, attempt)
+    try:
+        yield
+    finally:
+        _local.call = previous
+
+
+def _current_call():
+    return getattr(_local, "call", None) or ("other", "", 1)
+
+
+def estimate_cost(prompt_tokens, completion_tokens):
+    return (prompt_tokens * LLM_PROMPT_PRICE_PER_1M + completion_tokens * LLM_COMPLETION_PRICE_PER_1M) / 1e6
+
+
+class PipelineRecorder:
+    """一次管線執行的紀錄器。
+
+    LLM 請求會從摘要的執行緒池回報，因此各筆紀錄先在鎖內暫存於記憶體，
+    執行結束時才由管線執行緒一次 bulk_create；紀錄寫入失敗只印出警告，不影響處理工作本身。
+    """
+
+    def __init__(self, run):
+        self.run = run
+        self._lock = threading.Lock()
+        self._records = []  # 尚未寫入的 PipelineStage
+
+    def _add(self, record):
+        with self._lock:
+            self._records.append(record)
+
+    @contextmanager
+    def stage(self, name, label=""):
+        started_at, started = timezone.now(), time.perf_counter()
+        succeeded = False
+        try:
+            yield
+            succeeded = True
+        finally:
+            self._add(PipelineStage(kind="stage", name=name, label=label, started_at=started_at,
+                                    seconds=time.perf_counter() - started, succeeded=succeeded))
+
+    def record_llm_call(self, call, model, started_at, seconds, usage=None, error=None):
+        name, label, attempt = call
+        self._add(PipelineStage(
+            kind="llm", name=name, label=label[:100], model=model or "",
+            started_at=started_at, seconds=seconds, attempt=attempt, succeeded=error is None,
+            prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+            completion_tokens=getattr(usage, "completion_tokens", 0) or 0,
+            error=str(error) if error is not None else "",
+        ))
+
+    def record_reduce(self, timings):
+        # 階層式合併每一層（含最終整合）各記一筆，統計時依層分組
+        for item in timings.get("reduce_levels", []):
+            self._add(PipelineStage(kind="stage", name=f"reduce_level_{item['level']}",
+                                    label=f"第 {item['level']} 層合併（{item['batches']} 批）",
+                                    seconds=item["seconds"]))
+
+    def record_transcription(self, timings):
+        run = self.run
+        run.whisper_model = timings.get("model_size", "")
+        run.audio_seconds = timings.get("audio_seconds")
+        run.speech_seconds = timings.get("speech_seconds")
+        run.whisper_load_seconds = timings.get("whisper_load_seconds")
+        run.whisper_inference_seconds = timings.get("whisper_inference_seconds")
+        run.asr_segments = timings.get("segments", 0)
+        run.decode_seconds = timings.get("decode_seconds")
+        run.stored_audio_bytes = timings.get("stored_audio_bytes")
+        if run.audio_seconds and run.whisper_inference_seconds is not None:
+            run.real_time_factor = run.whisper_inference_seconds / run.audio_seconds
+
+    def finish(self, status, error=""):
+        run = self.run
+        with self._lock:
+            records, self._records = self._records, []
+        calls = [r for r in records if r.kind == "llm"]
+        run.status = status
+        run.error = error
+        run.finished_at = timezone.now()
+        run.total_seconds = (run.finished_at - run.started_at).total_seconds()
+        run.llm_calls = len(calls)
+        run.llm_retries = sum(1 for r in calls if r.attempt > 1)
+        run.llm_failures = sum(1 for r in calls if not r.succeeded)
+        run.prompt_tokens = sum(r.prompt_tokens for r in calls)
+        run.completion_tokens = sum(r.completion_tokens for r in calls)
+        try:
+            run.save()
+            for record in records:
+                record.run = run
+            PipelineStage.objects.bulk_create(records, batch_size=500)
+        except Exception as e:
+            print(f"⚠️ 執行紀錄寫入失敗（講次 {run.lecture_id}）：{e}")
+
+
+@contextmanager
+def pipeline_run(lecture):
+    run = PipelineRun(lecture=lecture)
+    try:
+        run.save()
+    except Exception as e:
+        # 結束時 finish 會再嘗試寫入一次
+        print(f"⚠️ 執行紀錄建立失敗（講次 {lecture.id}）：{e}")
+    recorder = PipelineRecorder(run)
+    try:
+        yield recorder
+    except Exception as e:
+        recorder.finish("failed", error=str(e))
+        raise
+    recorder.finish("done")
+
+
+class TracedCompletions:
+    def __init__(self, completions, recorder):
+        self._completions = completions
+        self._recorder = recorder
+
+    def create(self, **params):
+        call = _current_call()
+        model = params.get("model", "")
+        if params.get("stream") and LLM_STREAM_USAGE:
+            params.setdefault("stream_options", {"include_usage": True})
+        started_at, started = timezone.now(), time.perf_counter()
+        try:
+            response = self._completions.create(**params)
+        except Exception as e:
+            self._recorder.record_llm_call(call, model, started_at, time.perf_counter() - started, error=e)
+            raise
+        if params.get("stream"):
+            return self._traced_stream(response, call, model, started_at, started)
+        self._recorder.record_llm_call(call, model, started_at, time.perf_counter() - started,
+                                       usage=getattr(response, "usage", None))
+        return response
+
+    def _traced_stream(self, stream, call, model, started_at, started):
+        # 串流請求的延遲算到最後一個 chunk；usage 在最後一個（choices 為空的）chunk
+        usage, error = None, None
+        try:
+            for chunk in stream:
+                if getattr(chunk, "usage", None):
+                    usage = chunk.usage
+                yield chunk
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._recorder.record_llm_call(call, model, started_at, time.perf_counter() - started,
+                                           usage=usage, error=error)
+
+
+class _TracedChat:
+    def __init__(self, chat, recorder):
+        self.completions = TracedCompletions(chat.completions, recorder)
+
+
+class TracedOpenAIClient:
+    """包住 OpenAI client，記錄每次實際送出的 chat.completions 請求；放在 LLM 快取內層，快取命中不會記錄。"""
+
+    def __init__(self, client, recorder):
+        self._client = client
+        self.chat = _TracedChat(client.chat, recorder)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+# ---------- 統計 ----------
+
+def percentile(values, p):
+    """線性內插百分位數；values 需已排序。"""
+    if not values:
+        return None
+    k = (len(values) - 1) * p / 100
+    lower = int(k)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (k - lower)
+
+
+def _summary(values):
+    values = sorted(v for v in values if v is not None)
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p90": percentile(values, 90),
+        "p99": percentile(values, 99),
+        "max": values[-1] if values else None,
+    }
+
+
+def run_statistics(limit=PIPELINE_STATS_RUNS):
+    """最近 limit 次已結束執行的百分位統計：整體、各階段與各類 LLM 請求。"""
+    runs = list(
+        PipelineRun.objects.exclude(status="running").select_related("lecture").order_by("-started_at")[:limit]
+    )
+    for r in runs:
+        r.cost = estimate_cost(r.prompt_tokens, r.completion_tokens)
+    done = [r for r in runs if r.status == "done"]
+    overall = [
+        ("總處理時間（秒）", _summary(r.total_seconds for r in done)),
+        ("音訊長度（秒）", _summary(r.audio_seconds for r in done)),
+        ("音訊解碼（秒）", _summary(r.decode_seconds for r in done)),
+        ("音訊存檔（MB）", _summary(r.stored_audio_bytes / 1e6 for r in done if r.stored_audio_bytes is not None)),
+        ("Whisper 載入（秒）", _summary(r.whisper_load_seconds for r in done)),
+        ("Whisper 轉錄（秒）", _summary(r.whisper_inference_seconds for r in done)),
+        ("RTF", _summary(r.real_time_factor for r in done)),
+        ("LLM 請求數", _summary(r.llm_calls for r in done)),
+        ("Token 數", _summary(r.prompt_tokens + r.completion_tokens for r in done)),
+        ("估計費用（USD）", _summary(r.cost for r in done)),
+    ]
+
+    stage_seconds, llm = {}, {}
+    rows = PipelineStage.objects.filter(run__in=[r.id for r in runs]).values_list(
+        "kind", "name", "seconds", "succeeded", "attempt", "prompt_tokens", "completion_tokens"
+    )
+    for kind, name, seconds, succeeded, attempt, prompt_tokens, completion_tokens in rows.iterator():
+        if kind == "stage":
+            if succeeded:
+                stage_seconds.setdefault(name, []).append(seconds)
+            continue
+        item = llm.setdefault(name, {"seconds": [], "calls": 0, "retries": 0, "failures": 0,
+                                     "prompt_tokens": 0, "completion_tokens": 0})
+        item["calls"] += 1
+        item["retries"] += attempt > 1
+        item["failures"] += not succeeded
+        item["prompt_tokens"] += prompt_tokens
+        item["completion_tokens"] += completion_tokens
+        if succeeded:
+            item["seconds"].append(seconds)
+
+    llm_stats = []
+    for name, item in sorted(llm.items()):
+        calls = item["calls"]
+        llm_stats.append({
+            "name": name,
+            "calls": calls,
+            "retries": item["retries"],
+            "failures": item["failures"],
+            "avg_prompt_tokens": round(item["prompt_tokens"] / calls) if calls else 0,
+            "avg_completion_tokens": round(item["completion_tokens"] / calls) if calls else 0,
+            "cost": estimate_cost(item["prompt_tokens"], item["completion_tokens"]),
+            **_summary(item["seconds"]),
+        })
+
+    return {
+        "run_count": len(runs),
+        "failed_count": len(runs) - len(done),
+        "overall": overall,
+        "stages": [(name, _summary(values)) for name, values in sorted(stage_seconds.items())],
+        "llm": llm_stats,
+        "recent": runs[:20],
+    }
@@ -1,21 +1,35 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.db.models import Count, Q
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.db import transaction
+from django.db.models import BooleanField, Count, Exists, ExpressionWrapper, F, OuterRef, Q, Sum
+from django.db.models.functions import Substr
 from django.core.paginator import Paginator
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login
 from django.contrib.auth.models import User
 from django.contrib import messages
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
 from django.views.decorators.http import require_POST
+from django.utils import timezone
+from datetime import date, datetime, timedelta
+from urllib.parse import urlencode
 import json
 
-from .models import Lecture, Question, Student, Submission, Course, Profile
+from .models import Lecture, LectureJob, Question, Student, Submission, Course, Profile, LectureScore, ConceptScore
 from .forms import (
     UploadLectureForm,
     CourseForm,
     CustomUserCreationForm
 )
-from .ai_modules import process_audio_and_generate_quiz
+from .jobs import enqueue_lecture_processing, enqueue_live_transcription
+from . import metrics, page_cache, search, telemetry
+from .pagination import keyset_page
+from .exports import matrix_rows, question_rows, stream_csv, stream_xlsx
+from .grading import (
+    SUBMISSION_RESULT_CACHE_SECONDS, affected_student_ids, grade_quiz, invalidate_lecture_report, lecture_report,
+    lecture_report_data, rebuild_rollups, result_cache_key, student_results,
+)
 import os
 from django.conf import settings
 import re
@@ -31,8 +45,9 @@ def upload_lecture(request):
 
         if course_id and audio_file:
             course = Course.objects.get(id=course_id)
-            lecture = Lecture.objects.create(course=course, audio_file=audio_file)
-            process_audio_and_generate_quiz(lecture.id)
+            lecture = Lecture.objects.create(course=course, audio_file=audio_file,
+                                             audio_sha256=getattr(audio_file, 'sha256', ''))
+            enqueue_lecture_processing(lecture)
             return redirect('lecture_detail', lecture.id)
     courses = Course.objects.all()
     return render(request, 'upload.html', {'courses': courses})
@@ -42,42 +57,79 @@ def upload_lecture_for_course(request, course_id):
     if request.method == 'POST':
         audio_file = request.FILES.get('audio')
         if audio_file:
-            lecture = Lecture.objects.create(course=course, audio_file=audio_file, title=request.POST.get('title'))
-            process_audio_and_generate_quiz(lecture.id)
+            lecture = Lecture.objects.create(course=course, audio_file=audio_file, title=request.POST.get('title'),
+                                             audio_sha256=getattr(audio_file, 'sha256', ''))
+            enqueue_lecture_processing(lecture)
             return redirect('lecture_detail', lecture.id)
     return render(request, 'upload.html', {'course': course})
 
 def lecture_detail(request, lecture_id):
-    lecture = get_object_or_404(Lecture, pk=lecture_id)
-    questions = Question.objects.filter(lecture=lecture)
-    return render(request, 'lecture_detail.html', {'lecture': lecture, 'questions': questions})
+    # 頁面本身只查講次狀態；摘要與題目在片段快取未命中時才載入
+    lecture = get_object_or_404(Lecture.objects.only('id', 'status'), pk=lecture_id)
+    role = page_cache.user_role(request)
+    body_html = page_cache.render_fragment(
+        request, 'lecture_detail',
+        (page_cache.version('lecture', lecture.id), lecture.status, role),
+        'lecture_detail_body.html',
+        lambda: {
+            'lecture': Lecture.objects.defer('transcript', 'transcript_segments').get(pk=lecture.id),
+            'questions': list(Question.objects.filter(lecture_id=lecture.id).order_by('id')),
+            'role': role,
+        },
+        cacheable=lecture.status == 'done',
+    )
+    return render(request, 'lecture_detail.html', {'lecture': lecture, 'body_html': body_html})
+
+def lecture_questions_json(request, lecture_id):
+    # 出題以串流逐題存檔，講次頁面輪詢此端點即可邊產生邊顯示
+    lecture = get_object_or_404(Lecture.objects.only('id', 'status'), pk=lecture_id)
+    questions = Question.objects.filter(lecture=lecture).order_by('id').values('id', 'question_text', 'question_type')
+    return JsonResponse({
+        'status': lecture.status,
+        'status_display': lecture.get_status_display(),
+        'questions': list(questions),
+    })
 
 def lecture_list(request):
-    query = request.GET.get('q', '')
-    lectures = Lecture.objects.all()
+    query = request.GET.get('q', '').strip()
 
+    # 先對講次 id 分頁，只有目前頁面的講次才載入內容與統計
     if query:
-        lectures = lectures.filter(Q(summary__icontains=query))
+        # 🔍 全文檢索：依相關度排序，命中片段只對目前頁面計算
+        lecture_ids = search.search_lecture_ids(query)
+    else:
+        lecture_ids = Lecture.objects.order_by('-id').values_list('id', flat=True)
+
+    paginator = Paginator(lecture_ids, 5)
+    page_number = request.GET.get('page')
+    page_obj = paginator.get_page(page_number)
+    page_ids = list(page_obj.object_list)
 
-    lectures = lectures.order_by('-id')
-    for lec in lectures:
-        lec.is_ready = bool(lec.summary and lec.question_set.exists())
+    # 長文字欄位不載入，列表只需要摘要開頭
+    lectures = (
+        Lecture.objects.filter(id__in=page_ids)
+        .select_related('course')
+        .defer('transcript', 'transcript_segments', 'summary')
+        .annotate(
+            summary_preview=Substr('summary', 1, 100),
+            question_count=Count('question'),
+            is_ready=ExpressionWrapper(Q(status='done'), output_field=BooleanField()),
+        )
+        .in_bulk()
+    )
+    page_obj.object_list = [lectures[i] for i in page_ids if i in lectures]
+    if query:
+        snippets = search.search_snippets(query, page_ids)
+        for lec in page_obj.object_list:
+            lec.snippet = snippets.get(lec.id, '')
 
-    # ✅ 加上學生作答狀態
-    student = None
+    # ✅ 加上學生作答狀態（只查目前頁面的講次）
     answered_lecture_ids = set()
     if request.user.is_authenticated and hasattr(request.user, 'profile') and request.user.profile.role == 'student':
-        try:
-            student = Student.objects.get(user=request.user)
-            answered_lecture_ids = set(
-                Submission.objects.filter(student=student).values_list('question__lecture', flat=True)
-            )
-        except Student.DoesNotExist:
-            pass
-
-    paginator = Paginator(lectures, 5)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+        answered_lecture_ids = set(
+            LectureScore.objects.filter(student__user=request.user, lecture_id__in=page_ids)
+            .values_list('lecture_id', flat=True)
+        )
 
     return render(request, 'lecture_list.html', {
         'page_obj': page_obj,
@@ -87,7 +139,10 @@ def lecture_list(request):
 
 def delete_lecture(request, lecture_id):
     lecture = get_object_or_404(Lecture, id=lecture_id)
-    lecture.delete()
+    student_ids = affected_student_ids([lecture])
+    with transaction.atomic():
+        lecture.delete()
+        rebuild_rollups(student_ids)
     return redirect('lecture_list')
 
 # ---------- 測驗相關 ----------
@@ -113,14 +168,26 @@ def quiz(request, lecture_id):
 
 # ---------- 學生報告 ----------
 
+def _overall_score(student):
+    # 由各講次統計加總，不需掃描全部作答
+    totals = LectureScore.objects.filter(student=student).aggregate(total=Sum('total'), correct=Sum('correct'))
+    return totals['total'] or 0, totals['correct'] or 0
+
+def _most_missed_concepts(student, limit=5):
+    # 每題只能作答一次，常錯分析以概念統計表計算，不掃描作答紀錄
+    return (
+        ConceptScore.objects.filter(student=student)
+        .annotate(wrong_count=F('total') - F('correct'))
+        .filter(wrong_count__gt=0)
+        .order_by('-wrong_count', 'concept')[:limit]
+    )
+
 @login_required
 def student_report(request):
     student = get_object_or_404(Student, user=request.user)
-    submissions = Submission.objects.filter(student=student)
-    total = submissions.count()
-    correct = submissions.filter(is_correct=True).count()
+    total, correct = _overall_score(student)
     accuracy = (correct / total * 100) if total else 0
-    wrong = submissions.filter(is_correct=False).values('question__question_text').annotate(count=Count('id')).order_by('-count')[:5]
+    wrong = _most_missed_concepts(student)
     wrong_count = total - correct
 
 
@@ -135,7 +202,7 @@ def student_report(request):
 
 def student_weakness_report(request, student_id):
     student = get_object_or_404(Student, user=request.user)
-    weaknesses = Submission.objects.filter(student=student, is_correct=False).values('question__concept').annotate(count=Count('id')).order_by('-count')[:5]
+    weaknesses = _most_missed_concepts(student)
 
     return render(request, 'student_weakness_report.html', {
         'student': student,
@@ -155,8 +222,11 @@ def create_course(request):
     return render(request, 'create_course.html', {'form': form})
 
 def course_list(request):
-    courses = Course.objects.all().order_by('-date')
-    return render(request, 'course_list.html', {'courses': courses})
+    courses_html = page_cache.render_fragment(
+        request, 'course_list', (page_cache.version('courses'),), 'course_list_body.html',
+        lambda: {'courses': list(Course.objects.all().order_by('-date'))},
+    )
+    return render(request, 'course_list.html', {'courses_html': courses_html})
 
 def course_detail(request, course_id=None):
     course = get_object_or_404(Course, pk=course_id)
@@ -182,27 +252,34 @@ def course_detail(request, course_id=None):
             messages.warning(request, "⚠ 請選擇要上傳的音檔。")
             return redirect('course_detail', course_id=course.id)
 
-        # 建立講次並觸發 AI 處理
+        # 建立講次並排入 AI 處理佇列
         lecture = Lecture.objects.create(
             course=course,
             audio_file=audio_file,
-            title=lecture_title
-        )
-        print("🧠 呼叫 AI 處理開始")
-
-        process_audio_and_generate_quiz(
-            lecture.id,
-            num_mcq=num_mcq,
-            num_tf=num_tf
+            title=lecture_title,
+            audio_sha256=getattr(audio_file, 'sha256', '')  # 由 upload handler 在上傳時計算
         )
+        enqueue_lecture_processing(lecture, num_mcq=num_mcq, num_tf=num_tf)
 
         #messages.success(request, f"✅ 成功建立講次《{lecture_title}》並開始產生題目。")
         return redirect('lecture_detail', lecture.id)
 
-    lectures = Lecture.objects.filter(course=course).order_by('-date')
+    # 各狀態的講次數一併放進快取鍵；有講次還在處理中時摘要尚未產生，不寫入快取
+    status_counts = sorted(
+        Lecture.objects.filter(course=course).order_by().values_list('status').annotate(n=Count('id'))
+    )
+    lectures_html = page_cache.render_fragment(
+        request, 'course_detail',
+        (page_cache.version('course', course.id), ','.join(f'{status}{n}' for status, n in status_counts)),
+        'course_detail_lectures.html',
+        lambda: {'lectures': list(
+            Lecture.objects.filter(course=course).only('id', 'date', 'summary').order_by('-date')
+        )},
+        cacheable=all(status == 'done' for status, _ in status_counts),
+    )
     return render(request, 'course_detail.html', {
         'course': course,
-        'lectures': lectures,
+        'lectures_html': lectures_html,
     })
 
 # ---------- 使用者角色登入導向 ----------
@@ -273,7 +350,10 @@ def edit_course(request, course_id):
 @login_required
 def delete_course(request, course_id):
     course = get_object_or_404(Course, id=course_id)
-    course.delete()
+    student_ids = affected_student_ids(course.lecture_set.all())
+    with transaction.atomic():
+        course.delete()
+        rebuild_rollups(student_ids)
     return redirect('course_list')
 
 from django.shortcuts import render, redirect
@@ -308,35 +388,43 @@ def dashboard(request):
 
 @login_required
 def quiz(request, lecture_id):
-    lecture = get_object_or_404(Lecture, pk=lecture_id)
-    questions = Question.objects.filter(lecture=lecture)
+    lecture = get_object_or_404(
+        Lecture.objects.select_related('course').only('id', 'status', 'course__name'), pk=lecture_id)
 
     try:
         student = Student.objects.get(user=request.user)  # ✅ 改這裡，不是用 profile
     except Student.DoesNotExist:
         return HttpResponse("❌ 找不到對應的學生資料，請聯絡管理員。")
 
+    # ✅ 如果是提交作答：一次批改並寫入，重複送出由唯一限制擋下
+    if request.method == 'POST':
+        graded = grade_quiz(student, lecture, request.POST)
+        if graded is None:
+            return HttpResponse("⚠️ 你已經完成這份測驗，請勿重複作答。")
+        results, score = graded
+        # 批改完直接產生結果區塊並放入快取，之後查看解析不必再查詢
+        return render(request, 'submission_result.html', {
+            'lecture': lecture,
+            'results_html': _render_results(result_cache_key(student.id, lecture.id), results, score),
+        })
+
     # ✅ 防止學生重複作答
     if Submission.objects.filter(student=student, question__lecture=lecture).exists():
         return HttpResponse("⚠️ 你已經完成這份測驗，請勿重複作答。")
 
-    # ✅ 如果是提交作答
-    if request.method == 'POST':
-        for question in questions:
-            student_answer = request.POST.get(str(question.id))
-            correct = student_answer == question.correct_answer
-            Submission.objects.create(
-                student=student,
-                question=question,
-                student_answer=student_answer,
-                is_correct=correct
-            )
-        return redirect('lecture_detail', lecture_id)
-
-    # ✅ 顯示測驗表單
+    # ✅ 顯示測驗表單（題目片段依講次版本與狀態快取；題目還在產生時不快取，避免只看到部分題目）
+    quiz_html = page_cache.render_fragment(
+        request, 'quiz', (page_cache.version('lecture', lecture.id), lecture.status), 'quiz_body.html',
+        lambda: {
+            'lecture': Lecture.objects.select_related('course').only(
+                'id', 'date', 'summary', 'course__name').get(pk=lecture.id),
+            'questions': list(Question.objects.filter(lecture_id=lecture.id).order_by('id')),
+        },
+        cacheable=lecture.status == 'done',
+    )
     return render(request, 'quiz.html', {
         'lecture': lecture,
-        'questions': questions
+        'quiz_html': quiz_html,
     })
 
 
@@ -359,17 +447,46 @@ def edit_summary(request, lecture_id):
         return redirect('lecture_list')  # 導回課程總覽
     return render(request, 'edit_summary.html', {'lecture': lecture})
 
+@require_POST
+@login_required
+def regenerate_questions(request, lecture_id):
+    if request.user.profile.role != 'teacher':
+        return HttpResponseForbidden("只有老師可以重新產生題目")
+
+    lecture = get_object_or_404(Lecture, pk=lecture_id)
+    try:
+        num_mcq = int(request.POST.get('num_mcq', 3))
+        num_tf = int(request.POST.get('num_tf', 0))
+    except ValueError:
+        messages.error(request, "❌ 題目數量格式錯誤，請輸入數字。")
+        return redirect('lecture_detail', lecture.id)
+
+    # 檢查與排入工作在同一個交易內（鎖住講次），避免處理中的講次被刪題目、同時有兩個 worker 出題
+    with transaction.atomic():
+        lecture = Lecture.objects.select_for_update().get(pk=lecture.pk)
+        busy = LectureJob.objects.filter(lecture=lecture, status__in=['pending', 'running']).exists()
+        if lecture.status not in ('done', 'failed') or busy:
+            messages.warning(request, "⚠ 這個講次還在處理中，完成後才能重新出題。")
+            return redirect('lecture_detail', lecture.id)
+
+        # 逐字稿與摘要都已存檔，工作會直接從出題階段開始
+        student_ids = affected_student_ids([lecture])
+        Question.objects.filter(lecture=lecture).delete()
+        rebuild_rollups(student_ids)
+        enqueue_lecture_processing(lecture, num_mcq=num_mcq, num_tf=num_tf, regenerate_questions=True)
+        transaction.on_commit(lambda: invalidate_lecture_report(lecture.id))
+    messages.success(request, "✅ 已排入重新出題，請稍候重新整理此頁。")
+    return redirect('lecture_detail', lecture.id)
+
 @login_required
 def view_student_report_by_teacher(request, student_id):
     if request.user.profile.role != 'teacher':
         return HttpResponseForbidden("只有老師能查看學生報告")
     
     student = get_object_or_404(Student, id=student_id)
-    submissions = Submission.objects.filter(student=student)
-    total = submissions.count()
-    correct = submissions.filter(is_correct=True).count()
+    total, correct = _overall_score(student)
     accuracy = (correct / total * 100) if total else 0
-    wrong = submissions.filter(is_correct=False).values('question__question_text').annotate(count=Count('id')).order_by('-count')[:5]
+    wrong = _most_missed_concepts(student)
 
     return render(request, 'teacher_view_student_report.html', {
         'student': student,
@@ -384,77 +501,140 @@ def all_submissions(request):
     if not request.user.profile.role == 'teacher':
         return HttpResponseForbidden("你沒有權限查看此頁面")
 
-    submissions = Submission.objects.select_related('student', 'question', 'question__lecture')
+    filters = _submission_filters(request)
+    submissions = Submission.objects.select_related('student__user', 'question__lecture')
+    if filters['course']:
+        submissions = submissions.filter(question__lecture__course_id=filters['course'])
+    if filters['lecture']:
+        submissions = submissions.filter(question__lecture_id=filters['lecture'])
+    if filters['student']:
+        submissions = submissions.filter(student__user__username=filters['student'])
+    if filters['date_from']:
+        submissions = submissions.filter(submitted_at__gte=_day_start(filters['date_from']))
+    if filters['date_to']:
+        submissions = submissions.filter(submitted_at__lt=_day_start(filters['date_to'] + timedelta(days=1)))
+
+    # 依 (submitted_at, id) 由新到舊的游標分頁，對應 Submission 上的複合索引
+    submissions, next_cursor = keyset_page(submissions, ('submitted_at', 'id'), request.GET.get('cursor'))
     return render(request, 'all_submissions.html', {
         'submissions': submissions,
+        'next_cursor': next_cursor,
+        'filters': filters,
+        'filter_query': _filter_query(filters),
+        'courses': Course.objects.only('id', 'name').order_by('name'),
     })
 
+@login_required
+def export_gradebook(request):
+    if request.user.profile.role != 'teacher':
+        return HttpResponseForbidden("你沒有權限匯出成績")
+
+    course_id, lecture_id = _int_param(request, 'course'), _int_param(request, 'lecture')
+    kind = 'matrix' if request.GET.get('kind') == 'matrix' else 'questions'
+    rows = (matrix_rows if kind == 'matrix' else question_rows)(course_id, lecture_id)
+    filename = f"gradebook-{kind}-{timezone.localdate():%Y%m%d}"
+
+    # 逐列產生並串流輸出，不在記憶體中組出整份檔案
+    if request.GET.get('format') == 'xlsx':
+        response = StreamingHttpResponse(
+            stream_xlsx(rows, sheet_name='成績矩陣' if kind == 'matrix' else '作答明細'),
+            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        )
+        filename += '.xlsx'
+    else:
+        response = StreamingHttpResponse(stream_csv(rows), content_type='text/csv; charset=utf-8')
+        filename += '.csv'
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+def _int_param(request, name):
+    try:
+        return int(request.GET.get(name, ''))
+    except ValueError:
+        return None
+
+def _date_param(request, name):
+    try:
+        return date.fromisoformat(request.GET.get(name, ''))
+    except ValueError:
+        return None
+
+def _day_start(day):
+    # 以時間範圍比較而非 __date，才能使用 submitted_at 的索引
+    return timezone.make_aware(datetime.combine(day, datetime.min.time()))
+
+def _submission_filters(request):
+    return {
+        'course': _int_param(request, 'course'),
+        'lecture': _int_param(request, 'lecture'),
+        'student': request.GET.get('student', '').strip(),
+        'date_from': _date_param(request, 'date_from'),
+        'date_to': _date_param(request, 'date_to'),
+    }
+
+def _filter_query(filters):
+    # 翻頁連結沿用目前的篩選條件
+    return urlencode({k: v for k, v in filters.items() if v})
+
 @login_required
 def lecture_submissions(request, lecture_id):
-    lecture = get_object_or_404(Lecture, id=lecture_id)
-    submissions = Submission.objects.filter(question__lecture=lecture)
-
-    # 對每個學生統計該講次的作答情況
-    students_data = []
-    for student in Student.objects.all():
-        student_subs = submissions.filter(student=student)
-        total = student_subs.count()
-        correct = student_subs.filter(is_correct=True).count()
-        if total > 0:
-            students_data.append({
-                'student': student,
-                'total': total,
-                'correct': correct,
-                'accuracy': round(correct / total * 100, 2)
-            })
+    if request.user.profile.role != 'teacher':
+        return HttpResponseForbidden("只有老師能查看作答統計")
+    lecture = get_object_or_404(Lecture.objects.select_related('course'), id=lecture_id)
+    # 學生統計來自 LectureScore、每題正確率為一次分組計數，查詢數不隨學生人數增加
+    students_data, questions = lecture_report(lecture)
 
     return render(request, 'lecture_submissions.html', {
         'lecture': lecture,
-        'students_data': students_data
+        'students_data': students_data,
+        'questions': questions,
     })
 
+@login_required
+def lecture_submissions_json(request, lecture_id):
+    if request.user.profile.role != 'teacher':
+        return HttpResponseForbidden("只有老師能查看作答統計")
+    lecture = get_object_or_404(Lecture.objects.only('id'), id=lecture_id)
+    return JsonResponse(lecture_report_data(lecture))
+
 
 
 # 查看某學生的所有講次作答紀錄
 @login_required
 def student_submissions(request, student_id):
     student = get_object_or_404(Student, pk=student_id)
-    submissions = Submission.objects.filter(student=student).select_related('question__lecture__course')
-
-    summary = {}
-    for s in submissions:
-        lec = s.question.lecture
-        if lec.id not in summary:
-            summary[lec.id] = {
-                'lecture': lec,
-                'total': 0,
-                'correct': 0
-            }
-        summary[lec.id]['total'] += 1
-        if s.is_correct:
-            summary[lec.id]['correct'] += 1
-
-    result = []
-    for item in summary.values():
-        total = item['total']
-        correct = item['correct']
-        accuracy = round((correct / total) * 100, 2) if total > 0 else 0
-        result.append({
-            'lecture': item['lecture'],
-            'total': total,
-            'correct': correct,
-            'accuracy': accuracy
-        })
+    # 每個講次一列統計，accuracy 由 LectureScore 計算
+    scores = (
+        LectureScore.objects.filter(student=student)
+        .select_related('lecture__course')
+        .order_by('lecture__date', 'lecture_id')
+    )
 
     return render(request, 'student_submissions.html', {
         'student': student,
-        'submissions': result
+        'submissions': scores
     })
 
 @login_required
 def student_directory(request):
-    students = Student.objects.select_related('user').all()
-    return render(request, 'student_directory.html', {'students': students})
+    filters = {'course': _int_param(request, 'course'), 'q': request.GET.get('q', '').strip()}
+    students = Student.objects.select_related('user')
+    if filters['q']:
+        students = students.filter(user__username__startswith=filters['q'])
+    if filters['course']:
+        # 有作答過該課程任一講次的學生
+        students = students.filter(Exists(
+            LectureScore.objects.filter(student=OuterRef('pk'), lecture__course_id=filters['course'])
+        ))
+
+    students, next_cursor = keyset_page(students, ('id',), request.GET.get('cursor'), descending=False)
+    return render(request, 'student_directory.html', {
+        'students': students,
+        'next_cursor': next_cursor,
+        'filters': filters,
+        'filter_query': _filter_query(filters),
+        'courses': Course.objects.only('id', 'name').order_by('name'),
+    })
 
 # ---------- 題目解析頁 ----------
 
@@ -462,24 +642,25 @@ def student_directory(request):
 @login_required
 def submission_result(request, lecture_id):
     student = get_object_or_404(Student, user=request.user)
-    lecture = get_object_or_404(Lecture, id=lecture_id)
-    questions = Question.objects.filter(lecture=lecture)
-    submissions = Submission.objects.filter(student=student, question__lecture=lecture)
-
-    result = []
-    for q in questions:
-        sub = submissions.filter(question=q).first()
-        result.append({
-            'question': q,
-            'student_answer': sub.student_answer if sub else None,
-            'is_correct': sub.is_correct if sub else None,
-        })
+    lecture = get_object_or_404(Lecture.objects.select_related('course').only('id', 'course__name'), id=lecture_id)
+
+    # 作答送出後結果不會再變，只有題目變動時快取才會失效
+    key = result_cache_key(student.id, lecture.id)
+    results_html = cache.get(key)
+    if results_html is None:
+        results, score = student_results(student, lecture)
+        results_html = _render_results(key, results, score)
 
     return render(request, 'submission_result.html', {
         'lecture': lecture,
-        'results': result
+        'results_html': results_html,
     })
 
+def _render_results(cache_key, results, score):
+    html = render_to_string('submission_result_body.html', {'results': results, 'score': score})
+    cache.set(cache_key, html, SUBMISSION_RESULT_CACHE_SECONDS)
+    return html
+
 @login_required
 def edit_lecture_title(request, lecture_id):
     if request.user.profile.role != 'teacher':
@@ -504,35 +685,24 @@ def edit_lecture_title(request, lecture_id):
 @login_required
 def progress_report(request):
     student = get_object_or_404(Student, user=request.user)
-    submissions = Submission.objects.filter(student=student)
+    scores = list(
+        LectureScore.objects.filter(student=student)
+        .select_related('lecture')
+        .order_by('lecture__date', 'lecture_id')
+    )
 
     # 📊 基本統計
-    total = submissions.count()
-    correct = submissions.filter(is_correct=True).count()
+    total = sum(s.total for s in scores)
+    correct = sum(s.correct for s in scores)
     wrong_count = total - correct
     accuracy = round((correct / total * 100), 2) if total else 0
 
-    # ❗ 常錯題（最多五題）
-    wrong = (
-        submissions
-        .filter(is_correct=False)
-        .values('question__question_text')
-        .annotate(count=Count('id'))
-        .order_by('-count')[:5]
-    )
+    # ❗ 常錯概念（最多五個）
+    wrong = _most_missed_concepts(student)
 
     # 📈 講次正確率資料
-    stats = (
-        submissions
-        .values('question__lecture__title')
-        .annotate(
-            total=Count('id'),
-            correct=Count('id', filter=Q(is_correct=True))
-        )
-        .order_by('question__lecture__date')
-    )
-    labels = [s['question__lecture__title'] for s in stats]
-    data = [round(s['correct'] / s['total'] * 100, 2) for s in stats]
+    labels = [s.lecture.title for s in scores]
+    data = [s.accuracy for s in scores]
 
     # 💡 學習建議
     avg_accuracy = sum(data) / len(data) if data else 0
@@ -555,12 +725,8 @@ def progress_report(request):
         'suggestion': suggestion,
     })
 
-import tempfile
-from django.http import JsonResponse
-from django.core.files import File
-from pydub import AudioSegment
-from .models import Course, Lecture
-from .ai_modules import process_audio_and_generate_quiz
+def _parse_question_counts(request):
+    return int(request.POST.get('num_mcq', 0)), int(request.POST.get('num_tf', 0))
 
 @require_POST
 def record_and_process(request, course_id):
@@ -570,34 +736,108 @@ def record_and_process(request, course_id):
 
     # 題目數量
     try:
-        num_mcq = int(request.POST.get('num_mcq', 0))
-        num_tf = int(request.POST.get('num_tf', 0))
+        num_mcq, num_tf = _parse_question_counts(request)
     except ValueError:
         return JsonResponse({'error': '題目數量格式錯誤'}, status=400)
 
     if not audio_file or not lecture_title:
         return JsonResponse({'error': '缺少音檔或標題'}, status=400)
 
-    # 儲存 .webm 到暫存檔
-    with tempfile.NamedTemporaryFile(suffix='.webm', delete=False) as temp_webm:
-        for chunk in audio_file.chunks():
-            temp_webm.write(chunk)
-        webm_path = temp_webm.name
-
-    # 轉換為 .wav
-    wav_path = webm_path.replace('.webm', '.wav')
-    AudioSegment.from_file(webm_path, format='webm').export(wav_path, format='wav')
-
-    # 建立 Lecture 並儲存音檔
-    with open(wav_path, 'rb') as wav_file:
-        lecture = Lecture.objects.create(course=course, title=lecture_title)
-        lecture.audio_file.save(f"{lecture_title}.wav", File(wav_file))
-
-    # 執行 AI 分析
-    process_audio_and_generate_quiz(
-        lecture.id,
-        num_mcq=num_mcq,
-        num_tf=num_tf  # ✅ 加入是非題
+    # 瀏覽器錄的 webm（Opus）直接存檔，不在請求中轉成 WAV；worker 轉錄時才以 ffmpeg 解碼到記憶體
+    lecture = Lecture.objects.create(
+        course=course,
+        title=lecture_title,
+        audio_file=audio_file,
+        audio_sha256=getattr(audio_file, 'sha256', '')
     )
 
-    return JsonResponse({'success': True})
\ No newline at end of file
+    # 排入 AI 分析佇列
+    enqueue_lecture_processing(lecture, num_mcq=num_mcq, num_tf=num_tf)
+
+    return JsonResponse({'success': True, 'lecture_id': lecture.id})
+
+# ---------- 即時錄音（分段上傳、邊錄邊轉錄） ----------
+
+@require_POST
+@login_required
+def start_live_recording(request, course_id):
+    if request.user.profile.role != 'teacher':
+        return JsonResponse({'error': '只有老師可以錄音'}, status=403)
+    course = get_object_or_404(Course, id=course_id)
+    lecture_title = request.POST.get('lecture_title', '').strip()
+    if not lecture_title:
+        return JsonResponse({'error': '缺少標題'}, status=400)
+
+    # 錄音期間各分段直接附加到同一個 webm 檔
+    lecture = Lecture.objects.create(course=course, title=lecture_title, status='recording')
+    lecture.audio_file.name = f"lectures/recording_{lecture.id}.webm"
+    os.makedirs(os.path.dirname(lecture.audio_file.path), exist_ok=True)
+    open(lecture.audio_file.path, 'wb').close()
+    lecture.save(update_fields=['audio_file'])
+    return JsonResponse({'lecture_id': lecture.id})
+
+@require_POST
+@login_required
+def upload_recording_chunk(request, lecture_id):
+    if request.user.profile.role != 'teacher':
+        return JsonResponse({'error': '只有老師可以錄音'}, status=403)
+    chunk = request.FILES.get('chunk')
+    try:
+        index = int(request.POST.get('index', ''))
+    except ValueError:
+        return JsonResponse({'error': '分段編號格式錯誤'}, status=400)
+    if not chunk:
+        return JsonResponse({'error': '缺少錄音分段'}, status=400)
+
+    with transaction.atomic():
+        lecture = get_object_or_404(Lecture.objects.select_for_update(), pk=lecture_id, status='recording')
+        if index < lecture.recorded_chunks:
+            # 重送已收過的分段，直接回覆成功
+            return JsonResponse({'received': lecture.recorded_chunks})
+        if index > lecture.recorded_chunks:
+            return JsonResponse({'error': '分段順序錯誤', 'expected': lecture.recorded_chunks}, status=409)
+        with open(lecture.audio_file.path, 'ab') as f:
+            for part in chunk.chunks():
+                f.write(part)
+        lecture.recorded_chunks += 1
+        lecture.save(update_fields=['recorded_chunks'])
+
+    enqueue_live_transcription(lecture)
+    return JsonResponse({'received': lecture.recorded_chunks})
+
+@require_POST
+@login_required
+def stop_live_recording(request, lecture_id):
+    if request.user.profile.role != 'teacher':
+        return JsonResponse({'error': '只有老師可以錄音'}, status=403)
+    lecture = get_object_or_404(Lecture, pk=lecture_id, status='recording')
+    try:
+        num_mcq, num_tf = _parse_question_counts(request)
+    except ValueError:
+        return JsonResponse({'error': '題目數量格式錯誤'}, status=400)
+    if not lecture.recorded_chunks:
+        lecture.delete()
+        return JsonResponse({'error': '沒有收到任何錄音'}, status=400)
+
+    # 已即時轉錄的部分會沿用，完整處理只需補上尾段
+    enqueue_lecture_processing(lecture, num_mcq=num_mcq, num_tf=num_tf)
+    return JsonResponse({'success': True, 'lecture_id': lecture.id})
+
+
+# ---------- 效能監控 ----------
+
+def metrics_view(request):
+    if not metrics.is_authorized(request):
+        return HttpResponseForbidden("你沒有權限查看監控數據")
+    return HttpResponse(metrics.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@login_required
+def pipeline_stats(request):
+    if not (request.user.is_staff or request.user.profile.role == 'teacher'):
+        return HttpResponseForbidden("你沒有權限查看處理效能")
+    return render(request, 'pipeline_stats.html', {
+        'stats': telemetry.run_statistics(),
+        'prompt_price': telemetry.LLM_PROMPT_PRICE_PER_1M,
+        'completion_price': telemetry.LLM_COMPLETION_PRICE_PER_1M,
+    })
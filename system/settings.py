@@ -20,6 +20,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.RequestMetricsMiddleware',  # 每個請求的耗時 / SQL 統計，放最前面才量得到完整時間
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -56,10 +57,46 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # 處理管線會同時從多個執行緒寫入（段落摘要、LLM 快取、執行紀錄）：
+        # 交易一開始就取得寫入鎖，其他寫入者依 timeout 排隊等待，避免 deferred 交易升級鎖時直接丟出 database is locked
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
     }
 }
 
 STATIC_URL = 'static/'
+
+# 快取後端：db（預設，網站與 worker 共用同一個資料庫即可共用，需先執行 createcachetable）、
+# redis（需另外安裝 redis 套件）、file（只限同一台機器）、locmem（單一行程，僅供不啟動 worker 的本機開發）
+# run_lecture_worker 是獨立行程，處理完講次時清除的頁面快取版本必須讓網站行程看得到，因此啟用 worker 時不能使用 locmem
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'db')
+SHARED_CACHE_BACKENDS = ('file', 'db', 'redis')
+_CACHE_BACKENDS = {
+    'locmem': ('django.core.cache.backends.locmem.LocMemCache', 'ai-tutor'),
+    'file': ('django.core.cache.backends.filebased.FileBasedCache', os.getenv('CACHE_LOCATION', str(BASE_DIR / 'cache'))),
+    'db': ('django.core.cache.backends.db.DatabaseCache', os.getenv('CACHE_LOCATION', 'core_cache')),
+    'redis': ('django.core.cache.backends.redis.RedisCache', os.getenv('CACHE_LOCATION', 'redis://127.0.0.1:6379/1')),
+}
+CACHES = {
+    'default': {
+        'BACKEND': _CACHE_BACKENDS[CACHE_BACKEND][0],
+        'LOCATION': _CACHE_BACKENDS[CACHE_BACKEND][1],
+        'TIMEOUT': int(os.getenv('CACHE_TIMEOUT', '600')),
+    }
+}
+if CACHE_BACKEND != 'redis':  # redis 由伺服器自行淘汰，MAX_ENTRIES 只適用其他後端
+    CACHES['default']['OPTIONS'] = {'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', '10000'))}
+
+# Prometheus 抓取 /metrics 時帶的 Authorization: Bearer <token>；未設定時只有管理員帳號能查看
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# 上傳音檔時同步計算 sha256，供重複音檔比對使用
+FILE_UPLOAD_HANDLERS = [
+    'core.upload_handlers.HashingMemoryFileUploadHandler',
+    'core.upload_handlers.HashingTemporaryFileUploadHandler',
+]
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 ALLOWED_HOSTS = ['mis223450.com']  # 或 ['*'] 初期測試用
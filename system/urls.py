@@ -9,6 +9,7 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('', views.upload_lecture, name='upload_lecture'),
     path('lecture/<int:lecture_id>/', views.lecture_detail, name='lecture_detail'),
+    path('lecture/<int:lecture_id>/questions.json', views.lecture_questions_json, name='lecture_questions_json'),
     path('lecture/<int:lecture_id>/quiz/', views.quiz, name='quiz'),
     path("student/report/", views.student_report, name="student_report"),
     path('student/<int:student_id>/weakness/', views.student_weakness_report, name='student_weakness_report'),
@@ -27,14 +28,22 @@ urlpatterns = [
     path('course/<int:course_id>/delete/', views.delete_course, name='delete_course'),
     path('dashboard/', views.dashboard, name='dashboard'),
     path('lecture/<int:lecture_id>/edit_summary/', views.edit_summary, name='edit_summary'),
+    path('lecture/<int:lecture_id>/regenerate_questions/', views.regenerate_questions, name='regenerate_questions'),
     path('submissions/', views.all_submissions, name='all_submissions'),
+    path('submissions/export/', views.export_gradebook, name='export_gradebook'),
+    path('metrics', views.metrics_view, name='metrics'),
+    path('pipeline/stats/', views.pipeline_stats, name='pipeline_stats'),
     path('lecture/<int:lecture_id>/submissions/', views.lecture_submissions, name='lecture_submissions'),
+    path('lecture/<int:lecture_id>/submissions.json', views.lecture_submissions_json, name='lecture_submissions_json'),
     path('student/<int:student_id>/submissions/', views.student_submissions, name='student_submissions'),
     path('student/directory/', views.student_directory, name='student_directory'),
     path('lecture/<int:lecture_id>/result/', views.submission_result, name='submission_result'),
     path('lecture/<int:lecture_id>/edit_title/', views.edit_lecture_title, name='edit_lecture_title'),
     path('progress/', views.progress_report, name='progress_report'),
     path('course/<int:course_id>/record/', views.record_and_process, name='record_and_process'),
+    path('course/<int:course_id>/record/start/', views.start_live_recording, name='start_live_recording'),
+    path('lecture/<int:lecture_id>/record/chunk/', views.upload_recording_chunk, name='upload_recording_chunk'),
+    path('lecture/<int:lecture_id>/record/stop/', views.stop_live_recording, name='stop_live_recording'),
 
 
 ]